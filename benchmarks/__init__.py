@@ -0,0 +1,5 @@
+"""
+Offline micro-benchmarks for Dogbot. Run them from the repository root, like so: ::
+
+    python -m benchmarks.lang
+"""
@@ -0,0 +1,130 @@
+"""
+Measures the throughput and tail latency of every censorship filter, and of the engine that runs them all
+at once, against a synthetic corpus of messages. No Discord connection is needed.
+"""
+import argparse
+import random
+import statistics
+import string
+import time
+
+from dog.core.utils import zalgo_glyphs
+from dog.ext.censorship import CensorshipEngine, CensorType, WordAutomaton
+from dog.ext.censorship.filters import WordsCensorshipFilter, default_filters
+
+WORDS = ('the', 'dog', 'is', 'a', 'good', 'boy', 'and', 'i', 'love', 'him', 'lol', 'what', 'are', 'you', 'doing',
+         'tonight', 'gaming', 'server', 'hello', 'everyone', 'check', 'this', 'out')
+
+
+class StubMessage:
+    """ Stands in for :class:`discord.Message`. Filters only look at the content. """
+    def __init__(self, content: str):
+        self.content = content
+
+
+def sentence(rng: random.Random, length: int) -> str:
+    return ' '.join(rng.choice(WORDS) for _ in range(length))
+
+
+def long_url(rng: random.Random) -> str:
+    path = '/'.join(''.join(rng.choices(string.ascii_lowercase, k=12)) for _ in range(rng.randint(5, 30)))
+    return f'https://example.com/{path}?q=' + ''.join(rng.choices(string.ascii_letters, k=200))
+
+
+def corpus(rng: random.Random, size: int, *, pathological_size: int) -> 'List[StubMessage]':
+    """ Generates a corpus of messages. Most are ordinary chat, the rest are a mix of the nasty ones. """
+    generators = [
+        # ordinary chat, weighted by how common it is
+        (60, lambda: sentence(rng, rng.randint(1, 12))),
+        (15, lambda: sentence(rng, rng.randint(20, 300))),
+        (5, lambda: sentence(rng, 5) + ' ' + long_url(rng)),
+        (3, lambda: 'join discord.gg/' + ''.join(rng.choices(string.ascii_letters, k=8))),
+        (3, lambda: 'look https://www.youtube.com/watch?v=' + ''.join(rng.choices(string.ascii_letters, k=11))),
+        (3, lambda: f'https://cdn.example.com/a/{rng.randint(0, 10 ** 9)}.png'),
+        (2, lambda: 'free robux https://evil.example.com/download/setup.exe'),
+        (3, lambda: 'WHAT ARE YOU DOING TONIGHT ' * rng.randint(1, 5)),
+        (2, lambda: ''.join(c + ''.join(rng.choices(zalgo_glyphs, k=rng.randint(1, 15))) for c in 'zalgo is here')),
+        (1, lambda: 'crash ৣौ ' * 20),
+
+        # a run without spaces that almost, but never quite, looks like a link to a file. the link filters used to
+        # be regexes that backtracked cubically on these
+        (2, lambda: 'a.' * rng.randint(1, pathological_size) + '/' + 'b.' * rng.randint(1, pathological_size)),
+        (1, lambda: 'x' * 2000),
+    ]
+    weights = [w for w, _ in generators]
+    makers = [make for _, make in generators]
+    return [StubMessage(rng.choices(makers, weights=weights)[0]()) for _ in range(size)]
+
+
+def run(coro):
+    """ Runs a coroutine that never suspends, without an event loop. """
+    try:
+        coro.send(None)
+    except StopIteration as stop:
+        return stop.value
+    raise RuntimeError('coroutine suspended')
+
+
+def measure(name: str, check, messages: 'List[StubMessage]'):
+    """ Runs a check against every message, then prints throughput and latency percentiles. """
+    timings = []
+    violations = 0
+    clock = time.perf_counter
+
+    for msg in messages:
+        start = clock()
+        violated = check(msg)
+        timings.append(clock() - start)
+        violations += bool(violated)
+
+    total = sum(timings)
+    timings.sort()
+    p50 = statistics.median(timings) * 10 ** 6
+    p99 = timings[int(len(timings) * 0.99) - 1] * 10 ** 6
+    worst = timings[-1] * 10 ** 6
+    print(f'{name: <32} {len(messages) / total:>12,.0f} msg/s {p50:>9.1f}us p50 {p99:>9.1f}us p99 '
+          f'{worst:>10.1f}us max {violations:>7,} hits')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks censorship filters.')
+    parser.add_argument('--messages', type=int, default=20000, help='The amount of messages to generate.')
+    parser.add_argument('--seed', type=int, default=0, help='The seed to generate messages with.')
+    parser.add_argument('--words', type=int, default=2000, help='The amount of banned words to use.')
+    parser.add_argument('--pathological-size', type=int, default=40,
+                        help='The maximum size of pathological link-like messages.')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    messages = corpus(rng, args.messages, pathological_size=args.pathological_size)
+    lengths = sorted(len(m.content) for m in messages)
+    print(f'{len(messages):,} messages, median length {statistics.median(lengths):.0f}, '
+          f'max length {lengths[-1]:,}\n')
+
+    words = WordAutomaton(''.join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 10)))
+                          for _ in range(args.words))
+    words.add('robux')
+
+    for censorship_filter in default_filters:
+        instance = censorship_filter(words) if censorship_filter is WordsCensorshipFilter else censorship_filter()
+        measure(censorship_filter.__name__, lambda msg: run(instance.does_violate(msg)), messages)
+
+    print()
+
+    def one_after_another(msg):
+        # how the cog used to check messages, a filter and a coroutine per type
+        for censorship_filter in default_filters:
+            instance = censorship_filter(words) if censorship_filter is WordsCensorshipFilter else censorship_filter()
+            if run(instance.does_violate(msg)):
+                return True
+        return False
+    measure('Filters one after another', one_after_another, messages)
+
+    engine = CensorshipEngine(default_filters)
+    measure('CensorshipEngine (all types)', lambda msg: engine.scan(msg.content, words=words), messages)
+    regex_types = {CensorType.INVITES, CensorType.VIDEOSITES, CensorType.CAPS}
+    measure('CensorshipEngine (3 types)', lambda msg: engine.scan(msg.content, regex_types), messages)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""
+Measures localized string lookups per second, before and after the preloaded language catalog.
+"""
+import timeit
+
+from ruamel.yaml import YAML
+
+from dog.core.i18n import LanguageCatalog
+
+KEYS = ('err.see_help', 'cmd.prefix.prefixes', 'cmd.about.fields.git_rev', 'misc.cant_respond', 'does.not.exist')
+LANGS = ('en-US', 'pt-BR', 'en-SP')
+
+
+def _get_lang_data(lang):
+    with open(f'./resources/lang/{lang}.yml') as f:
+        return YAML(typ='safe').load(f)
+
+
+def _access_dot(dct, dot):
+    cur = dct
+    for part in dot.split('.'):
+        cur = cur[part]
+    return cur
+
+
+def yaml_lookup(key, lang):
+    """ The old lookup, which parsed both language files on every call. """
+    fallback_data = _get_lang_data('en-US')
+    lang_data = _get_lang_data(lang)
+
+    try:
+        return _access_dot(lang_data, key)
+    except KeyError:
+        try:
+            return _access_dot(fallback_data, key)
+        except KeyError:
+            return key
+
+
+def measure(name, lookup, number):
+    def run():
+        for lang in LANGS:
+            for key in KEYS:
+                lookup(key, lang)
+
+    elapsed = min(timeit.repeat(run, number=number, repeat=3))
+    rate = number * len(LANGS) * len(KEYS) / elapsed
+    print(f'{name: <8} {rate:>14,.0f} lookups/sec')
+    return rate
+
+
+def main():
+    catalog = LanguageCatalog()
+
+    # make sure that both lookups agree before timing them
+    for lang in LANGS:
+        for key in KEYS:
+            assert yaml_lookup(key, lang) == catalog.get(key, lang), (key, lang)
+
+    before = measure('yaml', yaml_lookup, 10)
+    after = measure('catalog', catalog.get, 100000)
+    print(f'speedup  {after / before:>14,.0f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+-- Moves logged messages into a table that is partitioned by month (see schema.sql), with an index for d?archive.
+-- Run this once against an existing database, with the bot stopped:
+--
+--   psql -U dogbot -d dogbot -f docker/postgres/migrations/0001_partition_messages.sql
+--
+-- Requires PostgreSQL 11 or newer.
+
+BEGIN;
+
+ALTER TABLE messages RENAME TO messages_legacy;
+ALTER INDEX messages_pkey RENAME TO messages_legacy_pkey;
+
+CREATE TABLE messages (
+  message_id bigint,
+  guild_id bigint,
+  channel_id bigint,
+  author_id bigint,
+  created_at timestamp without time zone,
+
+  original_content text,
+  new_content text,
+
+  attachments jsonb,
+
+  deleted boolean,
+  edited boolean,
+  deleted_at timestamp without time zone,
+  edited_at timestamp without time zone,
+
+  PRIMARY KEY (message_id, created_at)
+) PARTITION BY RANGE (created_at);
+
+CREATE INDEX messages_author_guild_created_at_idx ON messages (author_id, guild_id, created_at DESC);
+
+CREATE TABLE messages_default PARTITION OF messages DEFAULT;
+
+CREATE OR REPLACE FUNCTION create_messages_partition(month date) RETURNS text AS $$
+DECLARE
+  start_at date := date_trunc('month', month);
+  partition_name text := 'messages_' || to_char(start_at, '"y"YYYY"m"MM');
+BEGIN
+  EXECUTE format('CREATE TABLE IF NOT EXISTS %I PARTITION OF messages FOR VALUES FROM (%L) TO (%L)',
+                 partition_name, start_at, start_at + interval '1 month');
+  RETURN partition_name;
+END;
+$$ LANGUAGE plpgsql;
+
+-- a partition for every month that has messages, up to next month
+SELECT create_messages_partition(month::date)
+FROM generate_series(
+  date_trunc('month', coalesce((SELECT min(created_at) FROM messages_legacy), now() AT TIME ZONE 'utc')),
+  date_trunc('month', now() AT TIME ZONE 'utc') + interval '1 month',
+  interval '1 month'
+) AS month;
+
+-- rows without a creation date land in messages_default
+INSERT INTO messages (message_id, guild_id, channel_id, author_id, created_at, original_content, new_content,
+                      attachments, deleted, edited, deleted_at, edited_at)
+SELECT message_id, guild_id, channel_id, author_id, created_at, original_content, new_content, attachments,
+       deleted, edited, deleted_at, edited_at
+FROM messages_legacy;
+
+DROP TABLE messages_legacy;
+
+ANALYZE messages;
+
+COMMIT;
@@ -0,0 +1,13 @@
+-- Adds the indexes that d?archive --contains and --search use. Run this once against an existing database, after
+-- 0001_partition_messages.sql:
+--
+--   psql -U dogbot -d dogbot -f docker/postgres/migrations/0002_message_search.sql
+--
+-- Building the indexes can take a while on a large table, but the bot can keep running meanwhile.
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS messages_content_trgm_idx ON messages
+  USING gin ((coalesce(nullif(new_content, ''), original_content)) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS messages_content_tsv_idx ON messages
+  USING gin (to_tsvector('english', coalesce(nullif(new_content, ''), original_content)));
@@ -0,0 +1,19 @@
+-- Merges duplicate command_statistics rows, and makes command_name the primary key so command usage can be
+-- upserted. Run this once against an existing database, with the bot stopped:
+--
+--   psql -U dogbot -d dogbot -f docker/postgres/migrations/0003_command_statistics_key.sql
+
+BEGIN;
+
+CREATE TEMPORARY TABLE merged_command_statistics ON COMMIT DROP AS
+  SELECT command_name, sum(times_used)::int AS times_used, max(last_used) AS last_used
+  FROM command_statistics
+  WHERE command_name IS NOT NULL
+  GROUP BY command_name;
+
+TRUNCATE command_statistics;
+INSERT INTO command_statistics SELECT command_name, times_used, last_used FROM merged_command_statistics;
+
+ALTER TABLE command_statistics ADD PRIMARY KEY (command_name);
+
+COMMIT;
@@ -0,0 +1,17 @@
+-- Adds hourly command usage and latency rollups, for d?cstats --window and --slowest. Run this once against an
+-- existing database:
+--
+--   psql -U dogbot -d dogbot -f docker/postgres/migrations/0004_command_rollups.sql
+
+CREATE TABLE IF NOT EXISTS command_rollups (
+  command_name text,
+  hour timestamp without time zone,
+  uses int,
+  errors int,
+  latency_sum double precision,
+  latency_buckets int[],
+
+  PRIMARY KEY (command_name, hour)
+);
+
+CREATE INDEX IF NOT EXISTS command_rollups_hour_idx ON command_rollups (hour);
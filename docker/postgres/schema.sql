@@ -1,12 +1,28 @@
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
 CREATE USER datadog WITH password 'datadog';
 GRANT SELECT ON pg_stat_database TO datadog;
 
 CREATE TABLE command_statistics (
-  command_name text,
+  command_name text primary key,
   times_used int,
   last_used timestamp without time zone
 );
 
+-- hourly usage and latency of each command. latency_buckets is a histogram, see LATENCY_BUCKETS in dog/ext/stats.py
+CREATE TABLE command_rollups (
+  command_name text,
+  hour timestamp without time zone,
+  uses int,
+  errors int,
+  latency_sum double precision,
+  latency_buckets int[],
+
+  PRIMARY KEY (command_name, hour)
+);
+
+CREATE INDEX command_rollups_hour_idx ON command_rollups (hour);
+
 CREATE TABLE rps_exclusions (
   user_id bigint
 );
@@ -25,6 +41,13 @@ CREATE TABLE censorship_punishments (
   PRIMARY KEY(guild_id, censorship_type)
 );
 
+CREATE TABLE censorship_words (
+  guild_id bigint,
+  word text,
+
+  PRIMARY KEY(guild_id, word)
+);
+
 CREATE TABLE exhausted_reddit_posts (
   guild_id bigint,
   post_id text
@@ -97,7 +120,7 @@ CREATE TABLE profile_descriptions (
 );
 
 CREATE TABLE messages (
-  message_id bigint primary key,
+  message_id bigint,
   guild_id bigint,
   channel_id bigint,
   author_id bigint,
@@ -111,5 +134,32 @@ CREATE TABLE messages (
   deleted boolean,
   edited boolean,
   deleted_at timestamp without time zone,
-  edited_at timestamp without time zone
-);
+  edited_at timestamp without time zone,
+
+  PRIMARY KEY (message_id, created_at)
+) PARTITION BY RANGE (created_at);
+
+-- for d?archive
+CREATE INDEX messages_author_guild_created_at_idx ON messages (author_id, guild_id, created_at DESC);
+
+-- for d?archive --contains and --search, built on the content that d?archive shows
+CREATE INDEX messages_content_trgm_idx ON messages
+  USING gin ((coalesce(nullif(new_content, ''), original_content)) gin_trgm_ops);
+CREATE INDEX messages_content_tsv_idx ON messages
+  USING gin (to_tsvector('english', coalesce(nullif(new_content, ''), original_content)));
+
+-- catches rows that don't belong to a monthly partition. this should stay empty
+CREATE TABLE messages_default PARTITION OF messages DEFAULT;
+
+-- creates the monthly partition of messages that holds a date, if it doesn't exist yet. the bot creates
+-- partitions ahead of time, and drops them once they expire
+CREATE FUNCTION create_messages_partition(month date) RETURNS text AS $$
+DECLARE
+  start_at date := date_trunc('month', month);
+  partition_name text := 'messages_' || to_char(start_at, '"y"YYYY"m"MM');
+BEGIN
+  EXECUTE format('CREATE TABLE IF NOT EXISTS %I PARTITION OF messages FOR VALUES FROM (%L) TO (%L)',
+                 partition_name, start_at, start_at + interval '1 month');
+  RETURN partition_name;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,125 @@
+"""
+Counters of members, channels and emoji across every guild, kept up to date from gateway events.
+"""
+import asyncio
+import logging
+from collections import Counter
+
+import discord
+
+logger = logging.getLogger(__name__)
+
+
+class Aggregates:
+    """
+    Counts members (by status), channels and emoji across every guild. Reading the counts is cheap, because
+    they are adjusted as events come in instead of being counted on demand.
+
+    Members are counted once per guild that they're in, like :meth:`discord.Client.get_all_members`.
+
+    Events can be missed, so the counts are meant to be rebuilt from scratch with :meth:`build` every once in
+    a while.
+    """
+    def __init__(self):
+        #: The amount of members, by :class:`discord.Status`.
+        self.statuses = Counter()
+
+        #: Guild ID to member count.
+        self.guild_members = {}
+
+        #: The amount of channels, by type (``'text'``, ``'voice'``, or ``'other'``).
+        self.channels = Counter()
+
+        #: The amount of emoji.
+        self.emojis = 0
+
+        #: The amount of managed emoji.
+        self.managed_emojis = 0
+
+        # bot user ID -> amount of guilds that they're in. there are few enough bots to keep track of each one
+        self._bot_memberships = Counter()
+
+    def __repr__(self):
+        return f'<Aggregates members={self.members} guilds={len(self.guild_members)}>'
+
+    @property
+    def members(self) -> int:
+        """ Returns the amount of members. """
+        return sum(self.statuses.values())
+
+    @property
+    def bots(self) -> int:
+        """ Returns the amount of unique bot users. """
+        return len(self._bot_memberships)
+
+    def _add_bot(self, user_id: int, amount: int):
+        self._bot_memberships[user_id] += amount
+        if self._bot_memberships[user_id] <= 0:
+            del self._bot_memberships[user_id]
+
+    @staticmethod
+    def channel_type(channel) -> str:
+        if isinstance(channel, discord.TextChannel):
+            return 'text'
+        if isinstance(channel, discord.VoiceChannel):
+            return 'voice'
+        return 'other'
+
+    def add_member(self, member: discord.Member, amount: int = 1):
+        """ Counts a member. Pass an amount of ``-1`` to remove it. """
+        self.statuses[member.status] += amount
+        self.guild_members[member.guild.id] = self.guild_members.get(member.guild.id, 0) + amount
+        if member.bot:
+            self._add_bot(member.id, amount)
+
+    def update_member(self, before: discord.Member, after: discord.Member):
+        """ Accounts for a member changing their status. """
+        if before.status != after.status:
+            self.statuses[before.status] -= 1
+            self.statuses[after.status] += 1
+
+    def add_channel(self, channel, amount: int = 1):
+        """ Counts a channel. Pass an amount of ``-1`` to remove it. """
+        self.channels[self.channel_type(channel)] += amount
+
+    def add_emojis(self, emojis, amount: int = 1):
+        """ Counts some emoji. Pass an amount of ``-1`` to remove them. """
+        for emoji in emojis:
+            self.emojis += amount
+            self.managed_emojis += amount if emoji.managed else 0
+
+    def add_guild(self, guild: discord.Guild, amount: int = 1):
+        """ Counts a guild, along with all of its members, channels and emoji. Pass ``-1`` to remove it. """
+        for member in guild.members:
+            self.statuses[member.status] += amount
+            if member.bot:
+                self._add_bot(member.id, amount)
+        for channel in guild.channels:
+            self.add_channel(channel, amount)
+        self.add_emojis(guild.emojis, amount)
+
+        if amount > 0:
+            self.guild_members[guild.id] = len(guild.members)
+        else:
+            self.guild_members.pop(guild.id, None)
+
+    @classmethod
+    async def build(cls, guilds: 'Iterable[discord.Guild]', *, chunk_size: int = 1000) -> 'Aggregates':
+        """ Counts everything from scratch. Yields to the event loop every ``chunk_size`` members. """
+        aggregates = cls()
+        counted = 0
+
+        for guild in list(guilds):
+            aggregates.add_guild(guild)
+
+            counted += len(guild.members)
+            if counted >= chunk_size:
+                counted = 0
+                await asyncio.sleep(0)
+
+        return aggregates
+
+    def drift(self, other: 'Aggregates') -> int:
+        """ Returns how many members the counts of another :class:`Aggregates` are off from these by. """
+        return sum(abs(self.statuses[status] - other.statuses[status])
+                   for status in set(self.statuses) | set(other.statuses))
@@ -1,9 +1,12 @@
+import asyncio
 import datetime
 import importlib
+import json
 import os
 import logging
 
 import sys
+from collections import Counter
 
 import aiohttp
 import aioredis
@@ -11,11 +14,21 @@ import asyncpg
 import discord
 from discord.ext import commands
 
+from dog.core import metrics
 from dog.core.context import DogbotContext
 from dog.core.helpformatter import DogbotHelpFormatter
 
 logger = logging.getLogger(__name__)
 
+#: The prefix of all Redis pub/sub channels used by :meth:`BotBase.broadcast`.
+BROADCAST_PREFIX = 'dogbot:broadcast:'
+
+#: The longest to wait before subscribing to broadcasts again after the subscription was lost, in seconds.
+MAX_BROADCAST_BACKOFF = 60
+
+#: Where metrics are served if ``monitoring.metrics`` isn't configured.
+DEFAULT_METRICS_ADDRESS = ('127.0.0.1', 9187)
+
 
 class BotBase(commands.bot.BotBase):
     def __init__(self, *args, **kwargs):
@@ -35,11 +48,31 @@ class BotBase(commands.bot.BotBase):
             (self.cfg['db']['redis'], 6379), loop=self.loop)
         self.redis = self.loop.run_until_complete(redis_coroutine)
 
+        # aioredis connection used for pub/sub, subscribed connections can't run regular commands
+        redis_sub_coroutine = aioredis.create_redis(
+            (self.cfg['db']['redis'], 6379), loop=self.loop)
+        self.redis_sub = self.loop.run_until_complete(redis_sub_coroutine)
+        self.broadcast_listener = self.loop.create_task(self.listen_for_broadcasts())
+
         # asyncpg
         pg = self.cfg['db']['postgres']
         self.database = pg['database']
         self.pgpool = self.loop.run_until_complete(asyncpg.create_pool(**pg))
 
+        # open :class:`dog.core.utils.BatchWriter`s, flushed before the database pool is closed
+        self.batch_writers = set()
+
+        # amount of times each event was dispatched, for metrics
+        self.event_counts = Counter()
+
+        # prometheus exporter and readiness endpoint
+        metrics_cfg = self.cfg['monitoring'].get('metrics', {})
+        self.metrics_server = metrics.MetricsServer(self)
+        if metrics_cfg.get('enabled', True):
+            host = metrics_cfg.get('host', DEFAULT_METRICS_ADDRESS[0])
+            port = metrics_cfg.get('port', DEFAULT_METRICS_ADDRESS[1])
+            self.loop.run_until_complete(self.metrics_server.start(host, port))
+
         # load core extensions
         self._exts_to_load = []
         self.load_exts_recursively('dog/core/ext', 'Core recursive load')
@@ -109,6 +142,95 @@ class BotBase(commands.bot.BotBase):
             importlib.reload(module)
         logger.info('Finished reloading bot modules!')
 
+    def dispatch(self, event, *args, **kwargs):
+        self.event_counts[event] += 1
+        super().dispatch(event, *args, **kwargs)
+
+    def collect_metrics(self) -> 'List[metrics.MetricFamily]':
+        """ Returns metrics about the bot itself. Cogs contribute their own with :meth:`dog.Cog.collect_metrics`. """
+        latencies = getattr(self, 'latencies', None) or [(0, self.latency)]
+        families = [
+            metrics.gauge('dogbot_gateway_latency_seconds', 'Gateway heartbeat latency, by shard.',
+                          samples=(({'shard': shard_id}, latency) for shard_id, latency in latencies)),
+            metrics.gauge('dogbot_guilds', 'Guilds that the bot is in.', len(self.guilds)),
+            metrics.gauge('dogbot_users', 'Users that the bot can see.', len(self.users)),
+            metrics.gauge('dogbot_voice_clients', 'Connected voice clients.', len(self.voice_clients)),
+            metrics.counter('dogbot_events_total', 'Events dispatched, by type.',
+                            samples=(({'type': event}, count) for event, count in self.event_counts.items())),
+            metrics.gauge('dogbot_writer_pending', 'Writes buffered by batch writers, by writer.',
+                          samples=(({'writer': writer.name}, len(writer)) for writer in self.batch_writers)),
+            metrics.gauge('dogbot_uptime_seconds', 'Seconds since the bot booted.',
+                          (datetime.datetime.utcnow() - self.boot_time).total_seconds()),
+        ]
+
+        # older versions of asyncpg can't tell us this
+        if hasattr(self.pgpool, 'get_size'):
+            families.append(metrics.gauge('dogbot_pg_pool_connections', 'Connections in the database pool.',
+                                          self.pgpool.get_size()))
+            families.append(metrics.gauge('dogbot_pg_pool_idle_connections', 'Idle connections in the database pool.',
+                                          self.pgpool.get_idle_size()))
+
+        return families
+
+    async def broadcast(self, topic: str, data=None):
+        """ Publishes some JSON data to all Dogbot processes, including this one.
+
+        Every process receives it as the ``broadcast_<topic>`` event, with the data as the only argument.
+        This is used to keep in-memory caches coherent across processes.
+        """
+        await self.redis.publish_json(BROADCAST_PREFIX + topic, data)
+
+    async def listen_for_broadcasts(self):
+        """
+        Dispatches broadcasts sent by :meth:`broadcast` as events.
+
+        If the subscription is lost, this subscribes again with exponential backoff. Broadcasts might have been
+        missed in the meantime, so ``broadcasts_resubscribed`` is dispatched once it's back. Anything that caches
+        data kept coherent by broadcasts should drop or reload it then.
+        """
+        backoff = 1
+        subscribed_before = False
+
+        while True:
+            try:
+                if self.redis_sub.closed:
+                    self.redis_sub = await aioredis.create_redis((self.cfg['db']['redis'], 6379), loop=self.loop)
+                channel, = await self.redis_sub.psubscribe(BROADCAST_PREFIX + '*')
+
+                if subscribed_before:
+                    logger.info('Subscribed to broadcasts again, dropping caches that might have missed some.')
+                    self.dispatch('broadcasts_resubscribed')
+                subscribed_before = True
+                backoff = 1
+
+                while await channel.wait_message():
+                    message = await channel.get()
+                    if message is None:
+                        break
+                    self.handle_broadcast(*message)
+
+                logger.warning('Lost the broadcast subscription.')
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('Broadcast listener failed.')
+
+            logger.info('Subscribing to broadcasts again in %d second(s).', backoff)
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, MAX_BROADCAST_BACKOFF)
+
+    def handle_broadcast(self, name: bytes, payload: bytes):
+        """ Dispatches a received broadcast as an event. Malformed broadcasts are logged and skipped. """
+        topic = name.decode()[len(BROADCAST_PREFIX):]
+        try:
+            data = json.loads(payload.decode())
+        except ValueError:
+            logger.warning('Skipping malformed broadcast: %s %r', topic, payload)
+            return
+
+        logger.debug('Received broadcast: %s %s', topic, data)
+        self.dispatch('broadcast_' + topic, data)
+
     async def post_to_webhook(self, content=None, *, embed: discord.Embed=None):
         """ Posts to the configured health webhook.
 
@@ -3,14 +3,19 @@ The core Dogbot bot.
 """
 
 import asyncio
+import itertools
 import logging
 import traceback
 
 import discord
 from discord.ext import commands
-from ruamel.yaml import YAML
 
+from dog.core import metrics, utils
 from dog.core.base import BotBase
+from dog.core.correlation import DeletionCorrelator
+from dog.core.guildconfig import MIGRATED_KEY, GuildConfigCache, config_key, migrate_legacy_keys
+from dog.core.i18n import LanguageCatalog
+from dog.core.outbox import ModlogEntry, ModlogOutbox
 
 from . import errors
 
@@ -33,6 +38,34 @@ class DogBot(BotBase, discord.AutoShardedClient):
         # custom prefix cache
         self.prefix_cache = {}
 
+        # preloaded language data
+        self.lang_catalog = LanguageCatalog()
+
+        # guild configuration snapshots
+        self.config_cache = GuildConfigCache(self.redis)
+
+        # configuration is only read from the per-guild hashes, so legacy keys have to be moved before any events
+        # are handled
+        self.loop.run_until_complete(self.migrate_legacy_config())
+
+        # which message deletes were caused by the bot
+        self.deletions = DeletionCorrelator()
+
+        # guild id -> id of the resolved modlog channel, or None if the guild has none
+        self.modlog_channels = {}
+
+        # guild id -> generation of the resolution in flight, dropped when the guild's modlog channel is
+        # invalidated so that a resolution started before that isn't stored
+        self._modlog_resolving = {}
+        self._modlog_generations = itertools.count()
+
+        # coalesces modlog entries per guild
+        self.modlog_outbox = ModlogOutbox(self.deliver_modlog, loop=self.loop)
+
+        # ids of globally banned users, kept in sync through broadcasts
+        self.global_bans = set()
+        self.loop.run_until_complete(self.load_global_bans())
+
     @property
     def is_private(self) -> bool:
         """
@@ -81,25 +114,56 @@ class DogBot(BotBase, discord.AutoShardedClient):
         """
         return self.tick('red')
 
-    async def is_global_banned(self, user: discord.User) -> bool:
-        key = f'cache:globalbans:{user.id}'
+    async def migrate_legacy_config(self):
+        """ Moves guild configuration out of the legacy ``<guild id>:<name>`` keys, unless that's been done. """
+        if await self.redis.exists(MIGRATED_KEY):
+            return
 
-        if await self.redis.exists(key):
-            # use the cached value instead
-            return (await self.redis.get(key)).decode() == 'banned'
+        logger.info('Migrating legacy guild configuration...')
+        result = await migrate_legacy_keys(self.redis)
+        await self.redis.set(MIGRATED_KEY, 'on')
+        saved = result.bytes_before - result.bytes_after
+        logger.info('Migrated %d legacy configuration key(s) from %d guild(s). Memory: %s -> %s (%s saved)',
+                    result.keys, len(result.guilds), utils.filesize(result.bytes_before),
+                    utils.filesize(result.bytes_after), utils.filesize(saved))
 
+    async def load_global_bans(self):
+        """ Loads the set of globally banned users from the database. """
         async with self.pgpool.acquire() as conn:
-            # grab the record from postgres, if any
-            banned = (await conn.fetchrow('SELECT * FROM globalbans WHERE user_id = $1', user.id)) is not None
+            rows = await conn.fetch('SELECT user_id FROM globalbans')
+        self.global_bans = {row['user_id'] for row in rows}
+        logger.info('Loaded %d global ban(s).', len(self.global_bans))
 
-            # cache the banned value for 2 hours
-            await self.redis.set(key, 'banned' if banned else 'not banned', expire=7200)
+    async def is_global_banned(self, user: discord.User) -> bool:
+        """ Returns whether a user has been globally banned. This doesn't touch the network. """
+        return user.id in self.global_bans
 
-            # return whether banned or not
-            return banned
+    async def set_global_ban(self, user_id: int, banned: bool):
+        """
+        Updates the global ban cache for a user in this process, and broadcasts the change to the others.
+
+        .. NOTE::
+
+            This does not touch the database, the caller is expected to have done that already.
+        """
+        await self.on_broadcast_globalbans({'user_id': user_id, 'banned': banned})
+        await self.broadcast('globalbans', {'user_id': user_id, 'banned': banned})
+
+    async def on_broadcast_globalbans(self, data):
+        if data['banned']:
+            self.global_bans.add(data['user_id'])
+        else:
+            self.global_bans.discard(data['user_id'])
+
+    async def count_message(self):
+        try:
+            await self.redis.incr('stats:messages')
+        except Exception:
+            logger.exception('Failed to count a message.')
 
     async def on_message(self, msg):
-        await self.redis.incr('stats:messages')
+        # don't hold up commands for the round trip
+        self.loop.create_task(self.count_message())
 
         if not msg.author.bot and await self.is_global_banned(msg.author):
             return
@@ -121,29 +185,41 @@ class DogBot(BotBase, discord.AutoShardedClient):
                 self.prefix_cache[guild.id] = prefix_strings
             return [] if not prefixes else prefix_strings
 
-    def _get_lang_data(self, lang):
-        with open(f'./resources/lang/{lang}.yml') as f:
-            return YAML(typ='safe').load(f)
-
-    def _access_dot(self, dct, dot):
-        cur = dct
-        for part in dot.split('.'):
-            cur = cur[part]
-        return cur
-
     def lang(self, key: str, lang: str='en-US'):
-        fallback_data = self._get_lang_data('en-US')
-        lang_data = self._get_lang_data(lang)
-
-        try:
-            return self._access_dot(lang_data, key)
-        except KeyError:
-            # default to en-US
-            try:
-                return self._access_dot(fallback_data, key)
-            except KeyError:
-                # uhhh
-                return key
+        """ Returns a localized string, falling back to en-US (or the key itself) if it is missing. """
+        return self.lang_catalog.get(key, lang)
+
+    def collect_metrics(self):
+        cache = self.config_cache
+        outbox = self.modlog_outbox
+        pending = outbox.pending()
+        missing = sum(1 for channel_id in self.modlog_channels.values() if channel_id is None)
+        return super().collect_metrics() + [
+            metrics.gauge('dogbot_config_cache_guilds', 'Guilds with a cached configuration snapshot.', len(cache)),
+            metrics.counter('dogbot_config_cache_hits_total', 'Configuration reads served from memory.', cache.hits),
+            metrics.counter('dogbot_config_cache_misses_total', 'Configuration reads that loaded a snapshot.',
+                            cache.misses),
+            metrics.gauge('dogbot_global_bans', 'Globally banned users.', len(self.global_bans)),
+            metrics.gauge('dogbot_modlog_channel_cache_guilds', 'Guilds with a cached modlog channel, by whether '
+                          'they have one.', samples=(({'found': 'true'}, len(self.modlog_channels) - missing),
+                                                     ({'found': 'false'}, missing))),
+            metrics.gauge('dogbot_modlog_outbox_pending', 'Modlog entries waiting to be posted, by priority.',
+                          samples=(({'priority': str(priority).lower()}, pending[priority])
+                                   for priority in (True, False))),
+            metrics.gauge('dogbot_modlog_outbox_guilds', 'Guilds with modlog entries waiting to be posted.',
+                          len(outbox.queues)),
+            metrics.counter('dogbot_modlog_outbox_entries_total', 'Modlog entries queued, by priority.',
+                            samples=(({'priority': str(priority).lower()}, outbox.entries[priority])
+                                     for priority in (True, False))),
+            metrics.counter('dogbot_modlog_outbox_sends_total', 'Modlog messages sent.', outbox.sends),
+            metrics.counter('dogbot_modlog_outbox_edits_total', 'Modlog messages edited.', outbox.edits),
+        ]
+
+    def perform_full_reload(self):
+        super().perform_full_reload()
+
+        # pick up any language files that were changed
+        self.lang_catalog.refresh()
 
     async def prefix(self, bot, message: discord.Message):
         """ Returns prefixes for a message. """
@@ -154,7 +230,12 @@ class DogBot(BotBase, discord.AutoShardedClient):
     async def close(self):
         # close stuff
         logger.info('close() called, cleaning up...')
+        self.broadcast_listener.cancel()
+        await self.metrics_server.close()
+        await self.modlog_outbox.close()
         self.redis.close()
+        self.redis_sub.close()
+        await asyncio.gather(*(writer.close() for writer in list(self.batch_writers)))
         await self.pgpool.close()
         await self.session.close()
 
@@ -185,33 +266,97 @@ class DogBot(BotBase, discord.AutoShardedClient):
         """
         return any(text.startswith(p) for p in self.cfg['bot']['prefixes'])
 
-    async def send_modlog(self, guild: discord.Guild, *args, **kwargs):
+    async def send_modlog(self, guild: discord.Guild, content: str, *, priority: bool = False) \
+            -> 'Optional[ModlogEntry]':
         """
-        Sends a message to the #mod-log channel of a guild.
+        Queues a message to be sent to the #mod-log channel of a guild. Entries that are logged close together
+        are posted in one message, see :class:`dog.core.outbox.ModlogOutbox`.
 
-        If there is no #mod-log channel, no message is sent. All parameters are
-        passed to `send()`.
-        """
-        try:
-            key = 'modlog_channel_id'
-            manual_id = int(await self.config_get(guild, key))
-            manual_mod_log = discord.utils.get(guild.text_channels, id=manual_id)
-        except:
-            manual_mod_log = None
+        If there is no #mod-log channel, nothing is queued and ``None`` is returned.
 
-        mod_log = manual_mod_log or discord.utils.get(guild.text_channels, name='mod-log')
+        Args:
+            guild: The guild to log to.
+            content: The line to log.
+            priority: Whether this is about an action that a moderator took. These are posted first.
+
+        Returns:
+            The queued :class:`dog.core.outbox.ModlogEntry`, which can be edited like a message.
+        """
+        mod_log = await self.get_modlog_channel(guild)
 
         # don't post to mod-log, couldn't find the channel
         if mod_log is None:
             return
 
+        return self.modlog_outbox.put(mod_log, content, priority=priority)
+
+    async def get_modlog_channel(self, guild: discord.Guild) -> 'Optional[discord.TextChannel]':
+        """
+        Returns the modlog channel of a guild: the channel set with ``modlog_channel_id``, or else the channel
+        named #mod-log. Results are cached, including when there isn't one, until a channel or the guild's
+        configuration changes.
+        """
+        try:
+            channel_id = self.modlog_channels[guild.id]
+        except KeyError:
+            generation = self._modlog_resolving[guild.id] = next(self._modlog_generations)
+            channel_id = await self.resolve_modlog_channel(guild)
+
+            # only store it if nothing changed while we were resolving it
+            if self._modlog_resolving.get(guild.id) == generation:
+                del self._modlog_resolving[guild.id]
+                self.modlog_channels[guild.id] = channel_id
+
+        if channel_id is None:
+            return None
+
+        channel = guild.get_channel(channel_id)
+        if channel is None:
+            # the guild's channels changed from under us
+            self.invalidate_modlog_channel(guild.id)
+        return channel
+
+    async def resolve_modlog_channel(self, guild: discord.Guild) -> 'Optional[int]':
+        """ Finds the ID of the modlog channel of a guild, without looking at the cache. """
+        manual_id = await self.config_get(guild, 'modlog_channel_id')
+        if manual_id is not None:
+            try:
+                manual_mod_log = discord.utils.get(guild.text_channels, id=int(manual_id))
+            except ValueError:
+                logger.warning('Guild %d has an invalid modlog_channel_id: %r', guild.id, manual_id)
+                manual_mod_log = None
+
+            if manual_mod_log is not None:
+                return manual_mod_log.id
+
+        mod_log = discord.utils.get(guild.text_channels, name='mod-log')
+        return mod_log.id if mod_log is not None else None
+
+    def invalidate_modlog_channel(self, guild_id: int):
+        """ Forgets the modlog channel of a guild, so it's resolved again when it's needed. """
+        self.modlog_channels.pop(guild_id, None)
+        self._modlog_resolving.pop(guild_id, None)
+
+    async def on_guild_channel_create(self, channel: discord.abc.GuildChannel):
+        self.invalidate_modlog_channel(channel.guild.id)
+
+    async def on_guild_channel_delete(self, channel: discord.abc.GuildChannel):
+        self.invalidate_modlog_channel(channel.guild.id)
+
+    async def on_guild_channel_update(self, before: discord.abc.GuildChannel, after: discord.abc.GuildChannel):
+        self.invalidate_modlog_channel(after.guild.id)
+
+    async def on_guild_remove(self, guild: discord.Guild):
+        self.invalidate_modlog_channel(guild.id)
+
+    async def deliver_modlog(self, channel: discord.TextChannel, content: str) -> 'Optional[discord.Message]':
+        """ Sends a coalesced message from the modlog outbox. """
         try:
             await self.redis.incr('stats:modlog:sends')
-            return await mod_log.send(*args, **kwargs)
+            return await channel.send(content)
         except discord.Forbidden:
             # couldn't post to modlog
-            logger.warning('Couldn\'t post to modlog for guild %d. No permissions.', guild.id)
-            pass
+            logger.warning('Couldn\'t post to modlog for guild %d. No permissions.', channel.guild.id)
 
     async def set_playing_statuses(self):
         short_prefix = min(self.cfg['bot']['prefixes'], key=len)
@@ -224,11 +369,14 @@ class DogBot(BotBase, discord.AutoShardedClient):
 
         await self.set_playing_statuses()
 
-    async def config_get(self, guild: discord.Guild, name: str):
+        # we might have missed global ban broadcasts while disconnected
+        await self.load_global_bans()
+
+    async def config_get(self, guild: discord.Guild, name: str) -> 'Optional[str]':
         """
-        Returns configuration data for a guild.
+        Returns configuration data for a guild, or ``None`` if it isn't set.
         """
-        return (await self.redis.get(f'{guild.id}:{name}')).decode()
+        return (await self.config_cache.snapshot(guild.id)).get(name)
 
     async def config_is_set(self, guild: discord.Guild, name: str) -> bool:
         """
@@ -240,7 +388,33 @@ class DogBot(BotBase, discord.AutoShardedClient):
             checks if it exists. In Dogbot, a configuration key existing
             signifies that it is set.
         """
-        return await self.redis.exists(f'{guild.id}:{name}')
+        return name in await self.config_cache.snapshot(guild.id)
+
+    async def config_set(self, guild: discord.Guild, name: str, value: str):
+        """ Sets a configuration key for a guild, and tells all processes about it. """
+        await self.redis.hset(config_key(guild.id), name, value)
+        await self.config_changed(guild)
+
+    async def config_remove(self, guild: discord.Guild, name: str):
+        """ Removes a configuration key for a guild, and tells all processes about it. """
+        await self.redis.hdel(config_key(guild.id), name)
+        await self.config_changed(guild)
+
+    async def config_changed(self, guild: discord.Guild):
+        """ Drops cached configuration for a guild in this process, then in every other process. """
+        self.config_cache.invalidate(guild.id)
+        self.invalidate_modlog_channel(guild.id)
+        await self.broadcast('config', {'guild_id': guild.id})
+
+    async def on_broadcast_config(self, data):
+        self.config_cache.invalidate(data['guild_id'])
+        self.invalidate_modlog_channel(data['guild_id'])
+
+    async def on_broadcasts_resubscribed(self):
+        self.config_cache.clear()
+        self.modlog_channels.clear()
+        self._modlog_resolving.clear()
+        await self.load_global_bans()
 
     async def handle_forbidden(self, ctx):
         if not ctx.guild.me:
@@ -3,6 +3,11 @@ import logging
 
 class Cog:
     """ The Cog baseclass that all cogs should inherit from. """
+
     def __init__(self, bot):
         self.bot = bot
         self.logger = logging.getLogger('cog.' + type(self).__name__.lower())
+
+    def collect_metrics(self) -> 'List[dog.core.metrics.MetricFamily]':
+        """ Returns metrics to expose to Prometheus. Called every time metrics are scraped. """
+        return []
@@ -21,12 +21,16 @@ class FormattedCustomEmoji(commands.Converter):
 
 
 class Flags(commands.Converter):
+    # words, where double quoted parts can contain spaces
+    token_regex = re.compile(r'(?:[^\s"]|"[^"]*")+')
+
     async def convert(self, ctx, argument):
         result = {}
-        for flag in argument.split(' '):
+        for flag in self.token_regex.findall(argument):
             if '=' in flag:
-                parts = flag.split('=')
-                result[parts[0][2:]] = parts[1]
+                parts = flag.split('=', 1)
+                # allow quoted values, like --search="some words"
+                result[parts[0][2:]] = parts[1][1:-1] if parts[1][:1] == parts[1][-1:] == '"' else parts[1]
             else:
                 result[flag[2:]] = True
         return result
@@ -0,0 +1,66 @@
+"""
+Correlates message deletes with whatever caused them.
+"""
+import asyncio
+import contextlib
+import logging
+import typing
+
+from dog.core.utils import ExpiringSet
+
+logger = logging.getLogger(__name__)
+
+
+class DeletionCorrelator:
+    """
+    Keeps track of messages that the bot deleted (or saw being bulk deleted), so that listeners of
+    ``message_delete`` can tell those apart from messages that users deleted themselves.
+
+    Whoever deletes a message marks it first, so :meth:`is_suppressed` can usually answer right away. It only
+    waits when a delete is still in flight, because Discord can send the delete event before the request to
+    delete the message has even returned.
+    """
+    def __init__(self, *, ttl: float = 60, timeout: float = 2.0):
+        #: The longest that :meth:`is_suppressed` waits for an in-flight delete, in seconds.
+        self.timeout = timeout
+
+        #: IDs of messages whose delete events shouldn't be processed.
+        self.suppressed = ExpiringSet(ttl=ttl)
+
+        # message id -> future that is resolved once the delete request returns
+        self._pending = {}
+
+    def __len__(self):
+        return len(self.suppressed) + len(self._pending)
+
+    def suppress(self, message_ids: typing.Iterable[int]):
+        """ Marks messages as deleted by something other than their author. """
+        self.suppressed.update(message_ids)
+
+    @contextlib.contextmanager
+    def deleting(self, message_id: int):
+        """
+        Marks a message as being deleted for the duration of the block. Call :meth:`suppress` inside of the
+        block once the delete succeeds. Until the block exits, :meth:`is_suppressed` waits for it.
+        """
+        future = self._pending[message_id] = asyncio.get_event_loop().create_future()
+        try:
+            yield
+        finally:
+            self._pending.pop(message_id, None)
+            future.set_result(None)
+
+    async def is_suppressed(self, message_id: int) -> bool:
+        """ Returns whether the delete event of a message shouldn't be processed. """
+        if message_id in self.suppressed:
+            return True
+
+        future = self._pending.get(message_id)
+        if future is None:
+            return False
+
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except asyncio.TimeoutError:
+            logger.warning('Timed out waiting for the delete of %d to finish.', message_id)
+        return message_id in self.suppressed
@@ -0,0 +1,169 @@
+"""
+In-memory snapshots of guild configuration.
+"""
+import itertools
+import logging
+import re
+import time
+import typing
+from collections import OrderedDict, namedtuple
+
+import aioredis
+
+logger = logging.getLogger(__name__)
+
+MigrationResult = namedtuple('MigrationResult', 'keys guilds bytes_before bytes_after')
+
+#: Configuration keys that guilds are allowed to set.
+CONFIG_KEYS = (
+    'invisible_nag',
+    'modlog_filter_allow_bot',
+    'welcome_message',
+    'modlog_notrack_deletes',
+    'modlog_notrack_edits',
+    'modlog_channel_id',
+    'pollr_mod_log',
+    'log_all_message_events',
+    'shortlinks_enabled'
+)
+
+#: Set once :func:`migrate_legacy_keys` has run at startup, so it isn't run again.
+MIGRATED_KEY = 'guild_config:migrated'
+
+#: Matches configuration keys in the legacy ``<guild id>:<name>`` layout.
+LEGACY_KEY_REGEX = re.compile(r'(\d+):(' + '|'.join(CONFIG_KEYS) + ')')
+
+
+def config_key(guild_id: int) -> str:
+    """ Returns the name of the Redis hash that holds a guild's configuration. """
+    return f'guild_config:{guild_id}'
+
+
+async def memory_usage(redis, key: str) -> typing.Optional[int]:
+    """ Returns how many bytes a key takes up in Redis, or ``None`` if Redis can't tell us. """
+    try:
+        return await redis.execute(b'MEMORY', b'USAGE', key)
+    except aioredis.ReplyError:
+        # MEMORY USAGE was added in Redis 4.0
+        return None
+
+
+async def migrate_legacy_keys(redis) -> MigrationResult:
+    """
+    Moves configuration keys from the legacy ``<guild id>:<name>`` layout into one hash per guild.
+
+    This is safe to run while the bot is running, and more than once. Values that have already been set in
+    the new layout are never overwritten by legacy ones.
+    """
+    keys, guilds = 0, set()
+    bytes_before, bytes_after = 0, 0
+
+    async for key in redis.iscan(match='*:*'):
+        match = LEGACY_KEY_REGEX.fullmatch(key.decode())
+        if not match:
+            continue
+        guild_id, name = int(match.group(1)), match.group(2)
+
+        bytes_before += await memory_usage(redis, key) or 0
+        value = await redis.get(key)
+        if value is None:
+            # removed while we were scanning
+            continue
+
+        tr = redis.multi_exec()
+        tr.hsetnx(config_key(guild_id), name, value)
+        tr.delete(key)
+        await tr.execute()
+
+        logger.debug('Migrated %s to %s.', key.decode(), config_key(guild_id))
+        keys += 1
+        guilds.add(guild_id)
+
+    for guild_id in guilds:
+        bytes_after += await memory_usage(redis, config_key(guild_id)) or 0
+
+    return MigrationResult(keys=keys, guilds=guilds, bytes_before=bytes_before, bytes_after=bytes_after)
+
+
+class GuildConfigCache:
+    """
+    A LRU cache of guild configuration snapshots. A snapshot holds a guild's entire configuration hash, and
+    is loaded from Redis with a single HGETALL the first time that guild's configuration is read.
+
+    Snapshots are not updated in place. Instead, they are dropped with :meth:`invalidate` whenever a guild's
+    configuration changes, and are loaded again on the next read. As a backstop against missed invalidations,
+    snapshots also expire ``ttl`` seconds after they were loaded.
+    """
+    def __init__(self, redis, *, max_size: int = 5000, ttl: float = 300):
+        #: The Redis connection to load snapshots with.
+        self.redis = redis
+
+        #: The maximum amount of guilds to hold snapshots for.
+        self.max_size = max_size
+
+        #: How long snapshots are kept for, in seconds.
+        self.ttl = ttl
+
+        #: The amount of reads that were served from memory.
+        self.hits = 0
+
+        #: The amount of reads that required a snapshot to be loaded.
+        self.misses = 0
+
+        # guild id -> (expires at, snapshot)
+        self._snapshots = OrderedDict()
+
+        # guild id -> generation of the load in flight. invalidating drops it, so a load that was started before
+        # the invalidation doesn't store what it read
+        self._loading = {}
+        self._generations = itertools.count()
+
+    def __len__(self):
+        return len(self._snapshots)
+
+    @property
+    def hit_rate(self) -> float:
+        """ Returns the ratio of reads that were served from memory. """
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    async def _load(self, guild_id: int) -> typing.Dict[str, str]:
+        values = await self.redis.hgetall(config_key(guild_id))
+        return {name.decode(): value.decode() for name, value in values.items()}
+
+    async def snapshot(self, guild_id: int) -> typing.Dict[str, str]:
+        """ Returns all set configuration keys (and their values) for a guild. """
+        entry = self._snapshots.get(guild_id)
+        if entry is not None and entry[0] > time.monotonic():
+            self._snapshots.move_to_end(guild_id)
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        generation = self._loading[guild_id] = next(self._generations)
+        snapshot = await self._load(guild_id)
+
+        if self._loading.get(guild_id) != generation:
+            # invalidated while we were loading (or a newer load is in flight), this might be stale already
+            return snapshot
+        del self._loading[guild_id]
+
+        self._snapshots[guild_id] = (time.monotonic() + self.ttl, snapshot)
+        self._snapshots.move_to_end(guild_id)
+
+        # evict the least recently used snapshot
+        if len(self._snapshots) > self.max_size:
+            self._snapshots.popitem(last=False)
+
+        return snapshot
+
+    def clear(self):
+        """ Drops every snapshot. """
+        self._snapshots.clear()
+        self._loading.clear()
+
+    def invalidate(self, guild_id: int):
+        """ Drops the snapshot for a guild, if there is one. """
+        logger.debug('Invalidating configuration snapshot for %d.', guild_id)
+        self._snapshots.pop(guild_id, None)
+        self._loading.pop(guild_id, None)
@@ -0,0 +1,135 @@
+"""
+Language catalogs for Dogbot.
+
+All languages in ``resources/lang`` are parsed once and flattened into dicts keyed by dotted paths
+(``cmd.prefix.prefixes``). Every language is pre-merged over the default language, so a lookup is a
+single dict access instead of a YAML parse.
+"""
+import logging
+import pathlib
+import typing
+
+from ruamel.yaml import YAML
+
+logger = logging.getLogger(__name__)
+
+#: The language that is used when a key is missing from another language.
+DEFAULT_LANG = 'en-US'
+
+
+def flatten(data: typing.Dict[str, typing.Any], prefix: str = '') -> typing.Dict[str, typing.Any]:
+    """
+    Flattens a nested dict into a dict keyed by dotted paths. Only leaves are kept.
+
+    Parameters
+    ----------
+    data
+        The nested dict to flatten.
+    prefix
+        The prefix to add before every key.
+    """
+    flat = {}
+
+    for key, value in data.items():
+        path = f'{prefix}{key}'
+        if isinstance(value, dict):
+            flat.update(flatten(value, prefix=path + '.'))
+        else:
+            flat[path] = value
+
+    return flat
+
+
+class LanguageCatalog:
+    """
+    A preloaded, flattened collection of every language file in a directory.
+
+    Languages are only reparsed when the modification time of their file changes, which is checked when
+    :meth:`refresh` is called.
+    """
+    def __init__(self, directory: str = './resources/lang', *, default: str = DEFAULT_LANG):
+        #: The directory that language files are loaded from.
+        self.directory = pathlib.Path(directory)
+
+        #: The language to fall back to.
+        self.default = default
+
+        #: Flattened language data, as it appears in the language files.
+        self._raw = {}
+
+        #: Flattened language data, merged over the default language.
+        self._resolved = {}
+
+        #: Language file modification times, used to detect changes.
+        self._mtimes = {}
+
+        self.refresh()
+
+    @property
+    def languages(self) -> typing.List[str]:
+        """ Returns the names of all loaded languages. """
+        return sorted(self._raw.keys())
+
+    def _load(self, path: pathlib.Path) -> typing.Dict[str, typing.Any]:
+        with path.open() as f:
+            return flatten(YAML(typ='safe').load(f) or {})
+
+    def refresh(self) -> typing.List[str]:
+        """
+        Reloads all language files that have been added, changed, or removed since the last refresh.
+
+        Returns
+        -------
+        List[str]
+            The names of the languages that were reloaded.
+        """
+        changed = []
+        present = set()
+
+        for path in self.directory.glob('*.yml'):
+            lang = path.stem
+            present.add(lang)
+            mtime = path.stat().st_mtime
+
+            if self._mtimes.get(lang) == mtime:
+                continue
+
+            logger.debug('Loading language %s from %s.', lang, path)
+            self._raw[lang] = self._load(path)
+            self._mtimes[lang] = mtime
+            changed.append(lang)
+
+        for lang in set(self._raw) - present:
+            logger.debug('Language %s was removed, dropping it.', lang)
+            del self._raw[lang]
+            del self._mtimes[lang]
+            self._resolved.pop(lang, None)
+            changed.append(lang)
+
+        # if the default language changed, every other language needs to be merged again
+        to_resolve = self._raw.keys() if self.default in changed else [lang for lang in changed if lang in self._raw]
+        fallback = self._raw.get(self.default, {})
+        for lang in to_resolve:
+            self._resolved[lang] = {**fallback, **self._raw[lang]}
+
+        if changed:
+            logger.info('Loaded languages: %s', ', '.join(changed))
+
+        return changed
+
+    def get(self, key: str, lang: str = DEFAULT_LANG) -> typing.Any:
+        """
+        Looks up a key in a language. If the language doesn't have that key, the default language is used
+        instead. If no language has the key, the key itself is returned.
+
+        Parameters
+        ----------
+        key
+            The dotted key to look up, like ``err.not_in_dm``.
+        lang
+            The language to look the key up in.
+        """
+        catalog = self._resolved.get(lang)
+        if catalog is None:
+            catalog = self._resolved.get(self.default, {})
+        return catalog.get(key, key)
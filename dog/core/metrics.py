@@ -0,0 +1,144 @@
+"""
+A Prometheus exporter, served from the bot process.
+
+Metrics are gathered when they're scraped. Cogs can contribute their own by overriding
+:meth:`dog.Cog.collect_metrics`.
+"""
+import logging
+import math
+import typing
+from collections import namedtuple
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+#: A metric and its samples. ``samples`` is a list of ``(suffix, labels, value)``, where ``suffix`` is appended
+#: to the name (like ``_bucket`` for histograms) and ``labels`` is a dict.
+MetricFamily = namedtuple('MetricFamily', 'name type help samples')
+
+
+def gauge(name: str, help: str, value=None, *, samples: typing.Iterable[typing.Tuple[dict, float]] = ()) \
+        -> MetricFamily:
+    """ Creates a gauge, with either a single value or labelled samples. """
+    samples = [('', labels, sample) for labels, sample in samples]
+    if value is not None:
+        samples.append(('', {}, value))
+    return MetricFamily(name, 'gauge', help, samples)
+
+
+def counter(name: str, help: str, value=None, *, samples: typing.Iterable[typing.Tuple[dict, float]] = ()) \
+        -> MetricFamily:
+    """ Creates a counter, with either a single value or labelled samples. """
+    family = gauge(name, help, value, samples=samples)
+    return family._replace(type='counter')
+
+
+def histogram(name: str, help: str, bounds: typing.Sequence[float],
+              series: typing.Iterable[typing.Tuple[dict, typing.Sequence[int], float]]) -> MetricFamily:
+    """
+    Creates a histogram. ``series`` is a list of ``(labels, bucket counts, sum)``, where bucket counts are not
+    cumulative and have one more entry than ``bounds``, for values above the last bound.
+    """
+    samples = []
+    for labels, buckets, total in series:
+        cumulative = 0
+        for bound, count in zip(list(bounds) + [math.inf], buckets):
+            cumulative += count
+            samples.append(('_bucket', dict(labels, le=format_value(bound)), cumulative))
+        samples.append(('_count', labels, cumulative))
+        samples.append(('_sum', labels, total))
+    return MetricFamily(name, 'histogram', help, samples)
+
+
+def format_value(value) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if value == -math.inf:
+        return '-Inf'
+    if isinstance(value, float) and math.isnan(value):
+        return 'NaN'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def format_labels(labels: dict) -> str:
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+def render(families: typing.Iterable[MetricFamily]) -> str:
+    """ Renders metrics in the Prometheus text exposition format. """
+    lines = []
+    for family in families:
+        lines.append(f'# HELP {family.name} {family.help}')
+        lines.append(f'# TYPE {family.name} {family.type}')
+        for suffix, labels, value in family.samples:
+            lines.append(f'{family.name}{suffix}{format_labels(labels)} {format_value(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsServer:
+    """
+    Serves ``/metrics`` for Prometheus to scrape, and ``/ready``, which responds with 200 once the bot is
+    connected to Discord (and 503 otherwise) for health checks.
+    """
+    def __init__(self, bot):
+        self.bot = bot
+        self.app = web.Application()
+        self.app.router.add_get('/metrics', self.handle_metrics)
+        self.app.router.add_get('/ready', self.handle_ready)
+
+        self._handler = None
+        self._server = None
+
+    async def start(self, host: str, port: int) -> bool:
+        """
+        Starts serving. Returns whether that worked: if the address is taken, like by another bot process on the
+        same host, a warning is logged and the bot runs without metrics.
+        """
+        self._handler = self.app.make_handler()
+        try:
+            self._server = await self.bot.loop.create_server(self._handler, host, port)
+        except OSError as error:
+            logger.warning('Couldn\'t serve metrics on %s:%d, running without them: %s', host, port, error)
+            await self._handler.shutdown(0)
+            self._handler = None
+            return False
+
+        logger.info('Serving metrics on %s:%d.', host, port)
+        return True
+
+    async def close(self):
+        if self._server is None:
+            return
+        self._server.close()
+        await self._server.wait_closed()
+        await self._handler.shutdown(1.0)
+        self._server = None
+
+    def collect(self) -> typing.List[MetricFamily]:
+        """ Gathers metrics from the bot, and every cog. """
+        try:
+            families = self.bot.collect_metrics()
+        except Exception:
+            # e.g. when scraped while the bot is still being set up
+            logger.exception('Failed to collect metrics from the bot.')
+            families = []
+
+        for cog in list(self.bot.cogs.values()):
+            try:
+                families += cog.collect_metrics()
+            except Exception:
+                logger.exception('Failed to collect metrics from %s.', type(cog).__name__)
+        return families
+
+    async def handle_metrics(self, request):
+        return web.Response(text=render(self.collect()), content_type='text/plain',
+                            headers={'X-Content-Type-Options': 'nosniff'})
+
+    async def handle_ready(self, request):
+        ready = self.bot.is_ready() and not self.bot.is_closed()
+        return web.Response(text='ready\n' if ready else 'not ready\n', status=200 if ready else 503)
@@ -0,0 +1,246 @@
+"""
+Queues modlog entries per guild, and posts them in as few messages as possible.
+"""
+import asyncio
+import collections
+import heapq
+import itertools
+import logging
+import time
+import typing
+
+import discord
+
+logger = logging.getLogger(__name__)
+
+#: The longest message that Discord accepts.
+MESSAGE_LIMIT = 2000
+
+#: How full a coalesced message is allowed to get when it's sent. The rest is left over for entries that are
+#: edited after they're sent, like when the modlog finds out who was responsible for something.
+BATCH_LIMIT = 1500
+
+
+class RateLimiter:
+    """
+    Allows ``rate`` actions per ``per`` seconds, mirroring how Discord buckets message sends per channel. Waiting
+    here instead of running into a 429 keeps the rest of the bot's requests out of the global rate limit.
+    """
+    def __init__(self, rate: int, per: float):
+        self.rate = rate
+        self.per = per
+
+        # when the last `rate` actions happened
+        self._history = collections.deque(maxlen=rate)
+
+    def delay(self) -> float:
+        """ Returns how long to wait before the next action is allowed, in seconds. """
+        if len(self._history) < self.rate:
+            return 0.0
+        return max(0.0, self._history[0] + self.per - time.monotonic())
+
+    async def acquire(self):
+        """ Waits until an action is allowed, then counts one. """
+        delay = self.delay()
+        if delay:
+            await asyncio.sleep(delay)
+        self._history.append(time.monotonic())
+
+
+class ModlogEntry:
+    """
+    A line in a guild's modlog, returned by :meth:`ModlogOutbox.put`. It stands in for the message that it's
+    posted in, so it can be edited before or after it's sent.
+    """
+    def __init__(self, outbox: 'ModlogOutbox', channel: discord.TextChannel, content: str, *, priority: bool):
+        self.outbox = outbox
+        self.channel = channel
+        self.content = content
+
+        #: Whether this entry is about an action that a moderator took. These are posted first.
+        self.priority = priority
+
+        #: The entries that this entry was posted with, once it's been taken out of the queue.
+        self.batch = None  # type: Optional[_Batch]
+
+    @property
+    def guild(self) -> discord.Guild:
+        return self.channel.guild
+
+    async def edit(self, *, content: str):
+        """ Changes the content of this entry. If it has been posted already, the message is edited. """
+        self.content = content
+        if self.batch is not None:
+            await self.outbox.edit(self.batch)
+
+
+class _Batch:
+    """ Entries that are posted together in one message. """
+    def __init__(self, channel: discord.TextChannel, entries: typing.List[ModlogEntry]):
+        self.channel = channel
+        self.entries = entries
+
+        #: The message that the entries were posted in. ``None`` until it's sent, or if sending failed.
+        self.message = None  # type: Optional[discord.Message]
+
+    def render(self) -> str:
+        return '\n'.join(entry.content for entry in self.entries)
+
+
+class _GuildQueue:
+    def __init__(self, rate: int, per: float):
+        # (not priority, sequence, entry), so moderator actions come first, then oldest first
+        self.heap = []
+
+        # only one send or edit at a time per guild, the channel's bucket is shared between them anyway
+        self.lock = asyncio.Lock()
+        self.limiter = RateLimiter(rate, per)
+
+        #: The task posting entries, if any. It exits once the queue is empty.
+        self.task = None
+
+    def __len__(self):
+        return len(self.heap)
+
+    def take(self) -> _Batch:
+        """ Takes as many entries for the same channel as fit in one message. """
+        channel = self.heap[0][2].channel
+        entries, skipped, length = [], [], 0
+
+        while self.heap:
+            item = self.heap[0]
+            entry = item[2]
+
+            if entry.channel != channel:
+                # the modlog channel was changed, this one goes in the next batch
+                skipped.append(heapq.heappop(self.heap))
+                continue
+
+            # +1 for the newline in between
+            needed = len(entry.content) + (1 if entries else 0)
+            if entries and length + needed > BATCH_LIMIT:
+                break
+
+            heapq.heappop(self.heap)
+            entries.append(entry)
+            length += needed
+
+        for item in skipped:
+            heapq.heappush(self.heap, item)
+
+        batch = _Batch(channel, entries)
+        for entry in entries:
+            entry.batch = batch
+        return batch
+
+
+class ModlogOutbox:
+    """
+    Coalesces modlog entries per guild. Entries that arrive within ``window`` seconds of each other are posted
+    in one message instead of one each, and sends are paced at ``rate`` per ``per`` seconds per guild. During a
+    raid, this turns hundreds of sends that would each wait on Discord's rate limit into a handful.
+
+    ``send`` is a coroutine function that takes a channel and content, and returns the sent message or ``None``.
+    """
+    def __init__(self, send: typing.Callable[[discord.TextChannel, str], typing.Awaitable[discord.Message]], *,
+                 loop: asyncio.AbstractEventLoop, window: float = 1.0, rate: int = 5, per: float = 5.0):
+        self.loop = loop
+        self.window = window
+        self.rate = rate
+        self.per = per
+
+        self._send = send
+        self._sequence = itertools.count()
+
+        # guild id -> queue
+        self.queues = {}  # type: Dict[int, _GuildQueue]
+
+        #: The amount of entries that were queued, by priority.
+        self.entries = collections.Counter()
+
+        #: The amount of messages sent.
+        self.sends = 0
+
+        #: The amount of messages edited.
+        self.edits = 0
+
+    def __len__(self):
+        return sum(len(queue) for queue in self.queues.values())
+
+    def pending(self) -> typing.Dict[bool, int]:
+        """ Returns the amount of queued entries, by priority. """
+        counts = collections.Counter()
+        for queue in self.queues.values():
+            counts.update(item[2].priority for item in queue.heap)
+        return counts
+
+    def put(self, channel: discord.TextChannel, content: str, *, priority: bool = False) -> ModlogEntry:
+        """ Queues an entry to be posted to a modlog channel. """
+        entry = ModlogEntry(self, channel, content, priority=priority)
+        queue = self.queues.get(channel.guild.id)
+        if queue is None:
+            queue = self.queues[channel.guild.id] = _GuildQueue(self.rate, self.per)
+
+        heapq.heappush(queue.heap, (not priority, next(self._sequence), entry))
+        self.entries[priority] += 1
+
+        if queue.task is None:
+            queue.task = self.loop.create_task(self.drain(channel.guild.id, queue))
+        return entry
+
+    async def drain(self, guild_id: int, queue: _GuildQueue, *, wait: bool = True):
+        """ Posts entries until a guild's queue is empty. """
+        try:
+            if wait:
+                # let the rest of a burst pile up
+                await asyncio.sleep(self.window)
+
+            while queue.heap:
+                await queue.limiter.acquire()
+                async with queue.lock:
+                    await self.post(queue.take())
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception('Failed to drain the modlog outbox of %d.', guild_id)
+        finally:
+            queue.task = None
+            if not queue.heap and self.queues.get(guild_id) is queue:
+                del self.queues[guild_id]
+
+    async def post(self, batch: _Batch):
+        try:
+            batch.message = await self._send(batch.channel, batch.render())
+            self.sends += 1
+        except discord.HTTPException:
+            logger.exception('Failed to post %d modlog entries to %d.', len(batch.entries), batch.channel.id)
+
+    async def edit(self, batch: _Batch):
+        """ Edits the message of a batch to reflect the current content of its entries. """
+        queue = self.queues.get(batch.channel.guild.id)
+
+        # waits for the batch to be sent, if it's still being sent
+        lock = queue.lock if queue is not None else asyncio.Lock()
+        async with lock:
+            if batch.message is None:
+                return
+
+            content = batch.render()
+            if len(content) > MESSAGE_LIMIT:
+                logger.warning('Not editing modlog message %d, it would be too long.', batch.message.id)
+                return
+
+            try:
+                await batch.message.edit(content=content)
+                self.edits += 1
+            except discord.HTTPException:
+                logger.exception('Failed to edit modlog message %d.', batch.message.id)
+
+    async def close(self):
+        """ Posts everything that's left, without waiting for more to arrive. """
+        for guild_id, queue in list(self.queues.items()):
+            if queue.task is not None:
+                task = queue.task
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+            await self.drain(guild_id, queue, wait=False)
@@ -0,0 +1,103 @@
+"""
+An asyncio statsd client that aggregates metrics in memory.
+"""
+import asyncio
+import logging
+import typing
+
+logger = logging.getLogger(__name__)
+
+#: The largest datagram to send. Metrics are split across as many datagrams as needed.
+MAX_DATAGRAM_SIZE = 1432
+
+
+def format_metric(name: str, value, metric_type: str, tags: typing.Tuple[str, ...]) -> str:
+    """ Formats a metric in the DogStatsD datagram format. """
+    line = f'{name}:{value}|{metric_type}'
+    if tags:
+        line += '|#' + ','.join(tags)
+    return line
+
+
+class StatsdClient:
+    """
+    A statsd client that never blocks. Counters and gauges are aggregated in memory, and flushed as a few
+    batched UDP datagrams every ``interval`` seconds, instead of one datagram per call.
+    """
+    def __init__(self, host: str = 'localhost', port: int = 8125, *, interval: float = 5.0,
+                 loop: asyncio.AbstractEventLoop = None):
+        #: The address of the statsd server.
+        self.address = (host, port)
+
+        #: How often metrics are flushed, in seconds.
+        self.interval = interval
+
+        self.loop = loop or asyncio.get_event_loop()
+
+        # (name, tags) -> value
+        self._counters = {}
+        self._gauges = {}
+
+        self._transport = None
+
+        #: The :class:`asyncio.Task` that flushes metrics.
+        self.flusher = self.loop.create_task(self.flush_periodically())
+
+    def increment(self, name: str, value: int = 1, *, tags: typing.Iterable[str] = ()):
+        """ Increments a counter. """
+        key = (name, tuple(tags))
+        self._counters[key] = self._counters.get(key, 0) + value
+
+    def gauge(self, name: str, value: typing.Union[int, float], *, tags: typing.Iterable[str] = ()):
+        """ Sets a gauge. Only the last value set before a flush is sent. """
+        self._gauges[(name, tuple(tags))] = value
+
+    def datagrams(self) -> typing.List[bytes]:
+        """ Takes every aggregated metric, and packs them into datagrams. """
+        counters, self._counters = self._counters, {}
+        gauges, self._gauges = self._gauges, {}
+
+        lines = [format_metric(name, value, 'c', tags) for (name, tags), value in counters.items()]
+        lines += [format_metric(name, value, 'g', tags) for (name, tags), value in gauges.items()]
+
+        datagrams, current = [], b''
+        for line in lines:
+            encoded = line.encode()
+            if current and len(current) + 1 + len(encoded) > MAX_DATAGRAM_SIZE:
+                datagrams.append(current)
+                current = b''
+            current = current + b'\n' + encoded if current else encoded
+        if current:
+            datagrams.append(current)
+        return datagrams
+
+    async def flush(self):
+        """ Sends every aggregated metric. """
+        datagrams = self.datagrams()
+        if not datagrams:
+            return
+
+        if self._transport is None:
+            self._transport, _ = await self.loop.create_datagram_endpoint(asyncio.DatagramProtocol,
+                                                                          remote_addr=self.address)
+        for datagram in datagrams:
+            self._transport.sendto(datagram)
+
+    async def flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except OSError:
+                logger.warning('Couldn\'t send metrics, trying again soon.', exc_info=True)
+
+    async def close(self):
+        """ Stops flushing periodically, sends what's left, and closes the socket. """
+        self.flusher.cancel()
+        try:
+            await self.flush()
+        except OSError:
+            logger.warning('Couldn\'t send the last metrics.', exc_info=True)
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
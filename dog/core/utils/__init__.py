@@ -3,6 +3,7 @@ Various utilities for Dogbot.
 """
 
 from .enum import *
+from .expiring import *
 from .formatting import *
 from .graphics import *
 from .net import *
@@ -0,0 +1,87 @@
+import time
+import typing
+from collections import OrderedDict
+
+__all__ = ['ExpiringDict', 'ExpiringSet']
+
+
+class ExpiringDict:
+    """
+    A dict whose items expire ``ttl`` seconds after they were set. It never holds more than ``max_size`` items;
+    the oldest ones are evicted first. Lookups are O(1), and expired items are dropped as new ones are set.
+    """
+    def __init__(self, *, ttl: float, max_size: int = 100000):
+        #: How long items live for, in seconds.
+        self.ttl = ttl
+
+        #: The maximum amount of items.
+        self.max_size = max_size
+
+        # key -> (expires at, value), oldest first
+        self._items = OrderedDict()
+
+    def __repr__(self):
+        return f'<{type(self).__name__} ttl={self.ttl} size={len(self._items)}>'
+
+    def __len__(self):
+        self.prune()
+        return len(self._items)
+
+    def _get_live(self, key):
+        expires_at, value = self._items[key]
+        if expires_at <= time.monotonic():
+            del self._items[key]
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key) -> bool:
+        try:
+            self._get_live(key)
+            return True
+        except KeyError:
+            return False
+
+    def __getitem__(self, key):
+        return self._get_live(key)
+
+    def __setitem__(self, key, value):
+        # re-insert at the end, so items stay ordered by expiry
+        self._items.pop(key, None)
+        self._items[key] = (time.monotonic() + self.ttl, value)
+        self.prune()
+
+    def __delitem__(self, key):
+        del self._items[key]
+
+    def get(self, key, default=None):
+        try:
+            return self._get_live(key)
+        except KeyError:
+            return default
+
+    def pop(self, key, default=None):
+        value = self.get(key, default)
+        self._items.pop(key, None)
+        return value
+
+    def prune(self):
+        """ Drops expired items, and the oldest items past ``max_size``. """
+        now = time.monotonic()
+        items = self._items
+        while items and (len(items) > self.max_size or next(iter(items.values()))[0] <= now):
+            items.popitem(last=False)
+
+
+class ExpiringSet(ExpiringDict):
+    """ A set whose items expire ``ttl`` seconds after they were added. See :class:`ExpiringDict`. """
+    def add(self, item):
+        self[item] = None
+
+    def update(self, items: typing.Iterable):
+        for item in items:
+            self._items.pop(item, None)
+            self._items[item] = (time.monotonic() + self.ttl, None)
+        self.prune()
+
+    def discard(self, item):
+        self._items.pop(item, None)
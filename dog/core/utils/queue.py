@@ -3,8 +3,15 @@ import asyncio
 
 from abc import ABC, abstractmethod
 
+import asyncpg
+
 logger = logging.getLogger(__name__)
 
+#: Errors that a write might not run into if it's tried again later, like losing the connection to the database.
+TRANSIENT_ERRORS = (OSError, asyncio.TimeoutError, asyncpg.exceptions.InterfaceError,
+                    asyncpg.exceptions.PostgresConnectionError, asyncpg.exceptions.CannotConnectNowError,
+                    asyncpg.exceptions.TooManyConnectionsError, asyncpg.exceptions.TransactionRollbackError)
+
 
 class AsyncQueue(ABC):
     """
@@ -71,3 +78,163 @@ class AsyncQueue(ABC):
 
             self.current_item = None
             self._log('debug', 'Fulfilled item. %s', item)
+
+
+class BatchWriter(ABC):
+    """
+    Buffers writes in memory, and flushes them in batches from a background task. A batch is flushed once
+    ``batch_size`` writes are buffered, or ``interval`` seconds after the last flush, whichever comes first.
+
+    Once ``max_pending`` writes are buffered, writers wait (in :meth:`make_room`) until the next flush instead
+    of buffering more. Buffered writes are flushed when the writer is closed, and when the bot is closed.
+
+    A batch that fails with one of :data:`TRANSIENT_ERRORS` is tried again up to ``retries`` times, with
+    exponential backoff. A batch that fails with anything else is handed to :meth:`salvage`, so one bad write
+    doesn't take the rest of the batch with it.
+    """
+    def __init__(self, bot, name: str, *, batch_size: int = 500, max_pending: int = 10000, interval: float = 2.0,
+                 retries: int = 5):
+        #: The name of this :class:`BatchWriter`.
+        self.name = name
+
+        #: The bot instance to use.
+        self.bot = bot
+
+        #: The amount of buffered writes that triggers a flush.
+        self.batch_size = batch_size
+
+        #: The amount of buffered writes at which writers have to wait for a flush.
+        self.max_pending = max_pending
+
+        #: The maximum amount of seconds between flushes.
+        self.interval = interval
+
+        #: How many times a batch is tried again after a transient error.
+        self.retries = retries
+
+        # set when a flush should happen right away
+        self._wakeup = asyncio.Event()
+
+        # notified after every flush, for writers waiting on room
+        self._flushed = asyncio.Condition()
+
+        # only one flush at a time, so batches are written in order
+        self._flush_lock = asyncio.Lock()
+
+        #: The :class:`asyncio.Task` that flushes batches.
+        self.handler = bot.loop.create_task(self.handle())
+
+        bot.batch_writers.add(self)
+
+    def _log(self, level, msg, *args):
+        # "exception" isn't a level, it's an error with the traceback attached
+        exc_info = level == 'exception'
+        level = 'error' if exc_info else level
+        logger.log(getattr(logging, level.upper(), logging.INFO), f'[Writer] {self.name}: {msg}', *args,
+                   exc_info=exc_info)
+
+    @abstractmethod
+    def __len__(self):
+        """ Returns the amount of buffered writes. """
+        raise NotImplementedError
+
+    @abstractmethod
+    def take(self):
+        """ Returns all buffered writes as a batch, and empties the buffer. """
+        raise NotImplementedError
+
+    @abstractmethod
+    async def write(self, batch):
+        """ Writes a batch returned by :meth:`take`. """
+        raise NotImplementedError
+
+    async def salvage(self, batch) -> 'Optional[int]':
+        """
+        Writes what it can of a batch that :meth:`write` failed on with an error that retrying won't fix, like
+        one bad row. Returns how many writes were lost. By default, the whole batch is dropped, and ``None`` is
+        returned.
+        """
+        return None
+
+    async def write_with_retries(self, batch):
+        """ Writes a batch, retrying after transient errors and salvaging it after any other error. """
+        for attempt in range(self.retries + 1):
+            try:
+                await self.write(batch)
+                return
+            except TRANSIENT_ERRORS as error:
+                if attempt == self.retries:
+                    self._log('exception', 'Failed to write a batch %d times, it was dropped.', attempt + 1)
+                    return
+
+                delay = min(0.5 * 2 ** attempt, 30)
+                self._log('warning', 'Failed to write a batch (%r), trying again in %.1fs.', error, delay)
+                await asyncio.sleep(delay)
+            except Exception:
+                self._log('exception', 'Failed to write a batch, salvaging what we can.')
+                break
+
+        try:
+            lost = await self.salvage(batch)
+        except Exception:
+            self._log('exception', 'Failed to salvage a batch, it was dropped.')
+            return
+
+        if lost is None:
+            self._log('warning', 'Dropped a batch that failed to write.')
+        elif lost:
+            self._log('warning', 'Salvaged a batch, %d write(s) were lost.', lost)
+
+    async def make_room(self):
+        """ Waits until there is room to buffer another write. Call this before buffering. """
+        if len(self) < self.max_pending:
+            return
+
+        self._log('warning', 'Buffer is full (%d pending), waiting for a flush.', len(self))
+        self._wakeup.set()
+        async with self._flushed:
+            await self._flushed.wait_for(lambda: len(self) < self.max_pending)
+
+    def hold(self) -> asyncio.Lock:
+        """
+        Returns a lock that keeps batches from being written while it is held. Hold it to read both the buffer
+        and what has already been written, without a batch moving from one to the other in between.
+        """
+        return self._flush_lock
+
+    def buffered(self):
+        """ Flushes right away if a full batch is buffered. Call this after buffering. """
+        if len(self) >= self.batch_size:
+            self._wakeup.set()
+
+    async def flush(self):
+        """ Writes everything that is currently buffered. """
+        async with self._flush_lock:
+            self._wakeup.clear()
+            if not len(self):
+                return
+
+            batch = self.take()
+            async with self._flushed:
+                self._flushed.notify_all()
+
+            await self.write_with_retries(batch)
+
+    async def handle(self):
+        self._log('debug', 'Handler started.')
+
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+    async def close(self):
+        """ Stops the background task, and flushes anything that is still buffered. """
+        # wait for a flush in progress to finish first, cancelling it would lose the batch that it took
+        async with self._flush_lock:
+            self.handler.cancel()
+        self.bot.batch_writers.discard(self)
+        await self.flush()
+        self._log('debug', 'Closed.')
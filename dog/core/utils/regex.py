@@ -0,0 +1,252 @@
+import asyncio
+import collections
+import functools
+import logging
+import re
+import typing
+from concurrent.futures import ProcessPoolExecutor
+
+from .expiring import ExpiringSet
+
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
+
+logger = logging.getLogger(__name__)
+
+
+class UnsafePattern(Exception):
+    """ Raised when a user-supplied regex pattern is rejected by :func:`validate_pattern`. """
+    pass
+
+
+def _first_chars(subpattern) -> typing.Optional[typing.List[typing.Tuple[int, int]]]:
+    """
+    Returns the ranges of characters that a subpattern can start with, or ``None`` if that isn't known or it can
+    match the empty string.
+    """
+    for op, av in subpattern:
+        if op is sre_parse.LITERAL:
+            return [(av, av)]
+        elif op is sre_parse.IN:
+            ranges = []
+            for item_op, item_av in av:
+                if item_op is sre_parse.LITERAL:
+                    ranges.append((item_av, item_av))
+                elif item_op is sre_parse.RANGE:
+                    ranges.append(item_av)
+                else:
+                    # negated sets and categories, like \d
+                    return None
+            return ranges
+        elif op is sre_parse.SUBPATTERN:
+            return _first_chars(av[-1])
+        elif op is sre_parse.AT:
+            # anchors don't consume anything
+            continue
+        return None
+    return None
+
+
+def _overlaps(a, b) -> bool:
+    if a is None or b is None:
+        return True
+    return any(a_lo <= b_hi and b_lo <= a_hi for a_lo, a_hi in a for b_lo, b_hi in b)
+
+
+def _check_subpattern(subpattern, *, inside_repeat: bool):
+    for op, av in subpattern:
+        if op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT, getattr(sre_parse, 'POSSESSIVE_REPEAT', None)):
+            _, maximum, body = av
+            repeats = maximum > 1
+
+            # a repeat inside of a repeat, like (a+)+, is the textbook catastrophic backtracking pattern
+            if inside_repeat and repeats:
+                raise UnsafePattern('Nested quantifiers (like `(a+)+`) are not allowed.')
+
+            _check_subpattern(body, inside_repeat=inside_repeat or repeats)
+        elif op is sre_parse.GROUPREF or op is getattr(sre_parse, 'GROUPREF_EXISTS', None):
+            raise UnsafePattern('Backreferences are not allowed.')
+        elif op is sre_parse.SUBPATTERN:
+            _check_subpattern(av[-1], inside_repeat=inside_repeat)
+        elif op is sre_parse.BRANCH:
+            # alternatives that can match the same text, like (a|aa)*, backtrack just like nested quantifiers
+            if inside_repeat:
+                starts = [_first_chars(branch) for branch in av[1]]
+                if any(_overlaps(a, b) for i, a in enumerate(starts) for b in starts[i + 1:]):
+                    raise UnsafePattern('Repeated alternatives that can match the same text (like `(a|aa)*`) are '
+                                        'not allowed.')
+            for branch in av[1]:
+                _check_subpattern(branch, inside_repeat=inside_repeat)
+        elif op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+            _check_subpattern(av[1], inside_repeat=inside_repeat)
+        elif op is getattr(sre_parse, 'ATOMIC_GROUP', None):
+            _check_subpattern(av, inside_repeat=inside_repeat)
+
+
+def validate_pattern(pattern: str, *, max_length: int = 256):
+    """
+    Rejects regex patterns that are known to backtrack catastrophically, like nested quantifiers, repeated
+    alternatives that overlap, and backreferences.
+
+    Raises
+    ------
+    UnsafePattern
+        The pattern was rejected.
+    re.error
+        The pattern is invalid.
+    """
+    if len(pattern) > max_length:
+        raise UnsafePattern(f'Patterns can only be {max_length} characters long.')
+
+    _check_subpattern(sre_parse.parse(pattern), inside_repeat=False)
+
+
+@functools.lru_cache(maxsize=512)
+def compile_pattern(pattern: str) -> typing.Pattern:
+    """ Validates and compiles a regex pattern. Results are cached by pattern. """
+    validate_pattern(pattern)
+    return re.compile(pattern)
+
+
+def _search(pattern: str, string: str) -> bool:
+    # runs in a worker process, which has its own compile cache
+    return compile_pattern(pattern).search(string) is not None
+
+
+class RegexSandbox:
+    """
+    Runs user-supplied regexes in worker processes with a time limit, so a pattern that backtracks forever
+    can't freeze the event loop. Running them in a thread wouldn't help, because ``re`` holds the GIL while it
+    matches.
+
+    There are up to ``workers`` processes. Searches with the same ``key`` (like a guild ID) run one at a time,
+    so one key can only ever hold up one worker. Patterns that time out are remembered for ``ttl`` seconds and
+    rejected without running them again.
+    """
+    def __init__(self, *, timeout: float = 0.25, workers: int = 4, ttl: float = 3600):
+        #: How long a search can take once it starts running, in seconds.
+        self.timeout = timeout
+
+        #: The most worker processes to run at once.
+        self.workers = workers
+
+        #: Patterns that took too long recently.
+        self.timed_out = ExpiringSet(ttl=ttl)
+
+        # idle pools, with one worker process each
+        self._idle = []
+
+        # every pool, idle or busy
+        self._pools = set()
+
+        # limits how many pools are busy at once, created in the event loop that searches run in
+        self._slots = None
+
+        # key -> lock held while a search for that key runs, and how many searches are using it
+        self._locks = {}
+        self._lock_users = collections.Counter()
+
+    def validate(self, pattern: str):
+        """
+        Checks if a pattern can be searched with, like :func:`compile_pattern`, but also rejects patterns that
+        timed out recently.
+
+        Raises
+        ------
+        UnsafePattern
+            The pattern was rejected.
+        re.error
+            The pattern is invalid.
+        """
+        compile_pattern(pattern)
+        if pattern in self.timed_out:
+            raise UnsafePattern('This pattern took too long to match recently.')
+
+    def _kill(self, pool: ProcessPoolExecutor):
+        # shutdown() would wait for a runaway search to finish, so kill the worker first
+        for process in list(getattr(pool, '_processes', {}).values()):
+            process.terminate()
+        pool.shutdown(wait=False)
+        self._pools.discard(pool)
+
+    def shutdown(self):
+        """ Kills all worker processes. New ones are started when they're needed again. """
+        for pool in list(self._pools):
+            self._kill(pool)
+        self._idle.clear()
+
+    async def _take_pool(self, loop: asyncio.AbstractEventLoop) -> ProcessPoolExecutor:
+        if self._idle:
+            return self._idle.pop()
+
+        pool = ProcessPoolExecutor(max_workers=1)
+        self._pools.add(pool)
+        try:
+            # start the worker before any search is timed, starting a process can take a while
+            await loop.run_in_executor(pool, _search, '', '')
+        except BaseException:
+            self._kill(pool)
+            raise
+        return pool
+
+    async def _run(self, pattern: str, string: str, loop: asyncio.AbstractEventLoop) -> bool:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers)
+
+        async with self._slots:
+            pool = await self._take_pool(loop)
+            healthy = False
+            try:
+                # the clock only starts now that a worker is free to run the search
+                result = await asyncio.wait_for(loop.run_in_executor(pool, _search, pattern, string), self.timeout)
+                healthy = True
+                return result
+            except asyncio.TimeoutError:
+                logger.warning('Regex search took too long, killing worker. pattern=%r', pattern)
+                self.timed_out.add(pattern)
+                raise
+            finally:
+                if healthy:
+                    self._idle.append(pool)
+                else:
+                    # it might still be searching, or it's broken
+                    self._kill(pool)
+
+    async def search(self, pattern: str, string: str, *, key: typing.Hashable = None,
+                     loop: asyncio.AbstractEventLoop = None) -> bool:
+        """
+        Returns whether a pattern matches anywhere in a string.
+
+        Raises
+        ------
+        UnsafePattern
+            The pattern was rejected by :func:`validate_pattern`, or it timed out recently.
+        re.error
+            The pattern is invalid.
+        asyncio.TimeoutError
+            The search took too long, and was killed.
+        concurrent.futures.process.BrokenProcessPool
+            The worker process died.
+        """
+        # validate in this process first, so bad patterns never reach a worker
+        self.validate(pattern)
+
+        loop = loop or asyncio.get_event_loop()
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        self._lock_users[key] += 1
+
+        try:
+            async with lock:
+                # it might have timed out for someone else with the same key in the meantime
+                if pattern in self.timed_out:
+                    raise UnsafePattern('This pattern took too long to match recently.')
+                return await self._run(pattern, string, loop)
+        finally:
+            self._lock_users[key] -= 1
+            if not self._lock_users[key]:
+                del self._lock_users[key]
+                del self._locks[key]
@@ -2,7 +2,9 @@
 Contains censorship functionality.
 """
 
+import itertools
 import logging
+import time
 
 import asyncpg
 import discord
@@ -10,28 +12,105 @@ from discord.ext import commands
 
 from dog import Cog
 from dog.core import utils
-from dog.ext.censorship import CensorshipFilter, CensorType, PunishmentType
-from dog.ext.censorship.filters import InviteCensorshipFilter, VideositeCensorshipFilter, ZalgoCensorshipFilter, \
-    MediaLinksCensorshipFilter, ExecutableLinksCensorshipFilter, CapsCensorshipFilter, CrashTextCensorshipFilter
+from dog.ext.censorship import CensorshipEngine, CensorshipPolicy, CensorType, PunishmentType
+from dog.ext.censorship.filters import default_filters
+from dog.ext.censorship.wordlist import normalize
 
 logger = logging.getLogger(__name__)
 
+#: How long compiled censorship policies are cached for, in seconds.
+POLICY_TTL = 300
+
 
 class Censorship(Cog):
+    #: The maximum amount of banned words a guild can have.
+    MAX_WORDS = 5000
+
+    def __init__(self, bot):
+        super().__init__(bot)
+
+        #: A dict of guild IDs to their compiled :class:`CensorshipPolicy`. Guilds without a censorship record
+        #: map to ``None``.
+        self.policies = {}
+
+        # guild id -> when its cached policy expires, a backstop against missed broadcasts
+        self._expiry = {}
+
+        # guild id -> generation of the fetch in flight. any change drops it, so a fetch that was started before
+        # the change doesn't cache what it read
+        self._loading = {}
+        self._generations = itertools.count()
+
+        #: The engine that scans messages against all filters at once.
+        self.engine = CensorshipEngine(default_filters)
+
+    async def get_policy(self, guild: discord.Guild) -> 'Union[CensorshipPolicy, None]':
+        """ Returns the censorship policy for a guild, compiling it if it isn't cached. """
+        if guild.id in self.policies and self._expiry[guild.id] > time.monotonic():
+            return self.policies[guild.id]
+
+        generation = self._loading[guild.id] = next(self._generations)
+        async with self.bot.pgpool.acquire() as conn:
+            policy = await CensorshipPolicy.fetch(conn, guild.id)
+        logger.debug('Compiled censorship policy for %d: %s', guild.id, policy)
+
+        if self._loading.get(guild.id) != generation:
+            # changed while we were fetching (or a newer fetch is in flight), this might be stale already
+            return policy
+        del self._loading[guild.id]
+
+        self.policies[guild.id] = policy
+        self._expiry[guild.id] = time.monotonic() + POLICY_TTL
+        return policy
+
+    def drop_policy(self, guild_id: int):
+        """ Drops the cached censorship policy of a guild in this process, and any fetch of it in flight. """
+        self.policies.pop(guild_id, None)
+        self._expiry.pop(guild_id, None)
+        self._loading.pop(guild_id, None)
+
+    async def policy_changed(self, guild: discord.Guild):
+        """ Drops the cached censorship policy for a guild in this process, then in every other process. """
+        self.drop_policy(guild.id)
+        await self.bot.broadcast('censorship', {'guild_id': guild.id})
+
+    async def words_changed(self, guild: discord.Guild, *, added: 'List[str]' = (), removed: 'List[str]' = ()):
+        """ Updates the banned words of a guild in this process, then in every other process. """
+        data = {'guild_id': guild.id, 'added': list(added), 'removed': list(removed)}
+        await self.on_broadcast_censorship(data)
+        await self.bot.broadcast('censorship', data)
+
+    async def on_broadcasts_resubscribed(self):
+        self.policies.clear()
+        self._expiry.clear()
+        self._loading.clear()
+
+    async def on_broadcast_censorship(self, data):
+        if 'added' not in data and 'removed' not in data:
+            # something other than the banned words changed, drop the policy entirely
+            self.drop_policy(data['guild_id'])
+            return
+
+        # a fetch in flight might have read the words from before this change
+        self._loading.pop(data['guild_id'], None)
+
+        # banned words are updated in place, so we don't have to fetch and rebuild all of them
+        policy = self.policies.get(data['guild_id'])
+        if policy is None:
+            return
+        for word in data.get('added', []):
+            policy.words.add(word)
+        for word in data.get('removed', []):
+            policy.words.remove(word)
+
     async def is_censoring(self, guild: discord.Guild, what: CensorType) -> bool:
         """ Returns whether something is being censored for a guild. """
-        if not await self.has_censorship_record(guild):
-            return False
-        sql = 'SELECT enabled FROM censorship WHERE guild_id = $1'
-        async with self.bot.pgpool.acquire() as conn:
-            enabled = (await conn.fetchrow(sql, guild.id))['enabled']
-        return what.name in enabled
+        policy = await self.get_policy(guild)
+        return policy is not None and policy.is_censoring(what)
 
     async def has_censorship_record(self, guild: discord.Guild) -> bool:
         """ Returns whether a censorship record is present for a guild. """
-        sql = 'SELECT * FROM censorship WHERE guild_id = $1'
-        async with self.bot.pgpool.acquire() as conn:
-            return await conn.fetchrow(sql, guild.id) is not None
+        return await self.get_policy(guild) is not None
 
     async def censor(self, guild: discord.Guild, what: CensorType):
         """ Censors something for a guild. """
@@ -42,6 +121,7 @@ class Censorship(Cog):
                 await conn.execute('INSERT INTO censorship VALUES ($1, \'{}\', \'{}\')', guild.id)
             await conn.execute('UPDATE censorship SET enabled = array_append(enabled, $1) '
                                'WHERE guild_id = $2', what.name, guild.id)
+        await self.policy_changed(guild)
 
     async def delete_punishment(self, guild: discord.Guild, type: CensorType):
         """ Deletes a punishment. """
@@ -49,6 +129,7 @@ class Censorship(Cog):
         async with self.bot.pgpool.acquire() as conn:
             await conn.execute('DELETE FROM censorship_punishments WHERE guild_id = $1 AND censorship_type = $2',
                                guild.id, type.name)
+        await self.policy_changed(guild)
 
     async def add_punishment(self, guild: discord.Guild, type: CensorType, punishment: PunishmentType):
         """ Adds a punishment. """
@@ -56,14 +137,12 @@ class Censorship(Cog):
         async with self.bot.pgpool.acquire() as conn:
             await conn.execute('INSERT INTO censorship_punishments VALUES ($1, $2, $3)', guild.id, type.name,
                                punishment.name)
+        await self.policy_changed(guild)
 
     async def get_punishment(self, guild: discord.Guild, type: CensorType) -> 'Union[PunishmentType, None]':
         """ Returns a punishment for a censorship type. """
-        logger.debug('Fetching punishment. gid=%d, censor=%s', guild.id, type)
-        sql = 'SELECT punishment FROM censorship_punishments WHERE guild_id = $1 AND censorship_type = $2'
-        async with self.bot.pgpool.acquire() as conn:
-            row = await conn.fetchrow(sql, guild.id, type.name)
-            return getattr(PunishmentType, row['punishment'], None) if row else None
+        policy = await self.get_policy(guild)
+        return policy.punishments.get(type) if policy else None
 
     async def uncensor(self, guild: discord.Guild, what: CensorType):
         """ Uncensors something for a guild. """
@@ -73,6 +152,7 @@ class Censorship(Cog):
         async with self.bot.pgpool.acquire() as conn:
             await conn.execute('UPDATE censorship SET enabled = array_remove(enabled, $1) '
                                'WHERE guild_id = $2', what.name, guild.id)
+        await self.policy_changed(guild)
 
     async def carry_out_punishment(self, censor_type: CensorType, msg: discord.Message):
         """ Carries out a punishment. """
@@ -131,6 +211,7 @@ class Censorship(Cog):
         async with self.bot.pgpool.acquire() as conn:
             await conn.execute('UPDATE censorship SET exceptions = array_append(exceptions, $1) WHERE '
                                'guild_id = $2', role_id, ctx.guild.id)
+        await self.policy_changed(ctx.guild)
         await ctx.ok()
 
     @censorship.command(name='unexcept')
@@ -144,6 +225,7 @@ class Censorship(Cog):
         sql = 'UPDATE censorship SET exceptions = array_remove(exceptions, $1) WHERE guild_id = $2'
         async with self.bot.pgpool.acquire() as conn:
             await conn.execute(sql, role_id, ctx.guild.id)
+        await self.policy_changed(ctx.guild)
         await ctx.ok()
 
     @censorship.command(name='exceptions', aliases=['excepted'])
@@ -211,6 +293,72 @@ class Censorship(Cog):
         await self.uncensor(ctx.message.guild, censor_type)
         await ctx.ok()
 
+    @censorship.group(name='words', aliases=['w'], invoke_without_command=True)
+    async def censor_words(self, ctx):
+        """
+        Manages banned words. Messages containing a banned word on its own (not as part of another word) are
+        censored while `words` is being censored. Matching is case insensitive.
+
+        Add words with `d?cs words add`, then start censoring them with `d?cs censor words`.
+        """
+        await ctx.send('You need to specify a valid subcommand to run. For help, run `d?help cs words`.')
+
+    @censor_words.command(name='add')
+    async def censor_words_add(self, ctx, *, word: str):
+        """
+        Adds a banned word or phrase.
+
+        Example:
+            d?cs words add heck
+        """
+        word = normalize(word)
+
+        if not word or len(word) > 100:
+            return await ctx.send('Banned words must be between 1 and 100 characters long.')
+
+        async with ctx.acquire() as conn:
+            count = await conn.fetchval('SELECT COUNT(*) FROM censorship_words WHERE guild_id = $1', ctx.guild.id)
+            if count >= self.MAX_WORDS:
+                return await ctx.send(f'You can only have {utils.commas(self.MAX_WORDS)} banned words.')
+            try:
+                await conn.execute('INSERT INTO censorship_words VALUES ($1, $2)', ctx.guild.id, word)
+            except asyncpg.UniqueViolationError:
+                return await ctx.send('That word is already banned.')
+
+        await self.words_changed(ctx.guild, added=[word])
+        await ctx.ok()
+
+    @censor_words.command(name='remove', aliases=['rm', 'del', 'delete'])
+    async def censor_words_remove(self, ctx, *, word: str):
+        """ Removes a banned word or phrase. """
+        word = normalize(word)
+
+        async with ctx.acquire() as conn:
+            result = await conn.execute('DELETE FROM censorship_words WHERE guild_id = $1 AND word = $2',
+                                        ctx.guild.id, word)
+        if result == 'DELETE 0':
+            return await ctx.send('That word isn\'t banned.')
+
+        await self.words_changed(ctx.guild, removed=[word])
+        await ctx.ok()
+
+    @censor_words.command(name='list', aliases=['ls'])
+    async def censor_words_list(self, ctx):
+        """ Lists banned words. They are sent to you in a direct message. """
+        async with ctx.acquire() as conn:
+            rows = await conn.fetch('SELECT word FROM censorship_words WHERE guild_id = $1 ORDER BY word',
+                                    ctx.guild.id)
+
+        if not rows:
+            return await ctx.send('There are no banned words.')
+
+        paginator = commands.Paginator()
+        for row in rows:
+            paginator.add_line(row['word'])
+        for page in paginator.pages:
+            await ctx.author.send(page)
+        await ctx.ok()
+
     @censorship.group(name='punish', aliases=['p'])
     @commands.guild_only()
     @commands.has_permissions(manage_guild=True)
@@ -257,58 +405,59 @@ class Censorship(Cog):
             status = {r['censorship_type'].lower(): r['punishment'].lower() for r in punishments}
             await ctx.send(utils.format_dict(status))
 
-    async def should_censor(self, msg: discord.Message, filter: CensorshipFilter) -> bool:
-        """ Returns whether a message should be censored based on a censorship filter and censor type. """
-        return await self.is_censoring(msg.guild, filter.censor_type) and await filter().does_violate(msg)
-
     async def censor_message(self, msg: discord.Message, filter):
         """ Censors a message, and posts to the modlog. """
         self.bot.dispatch('message_censor', filter, msg)
-        try:
-            await msg.delete()
-        except discord.Forbidden:
-            msg = "\N{CROSS MARK} I failed to censor that message because I couldn't delete it."
-            await self.bot.send_modlog(msg.guild, msg)
+        with self.bot.deletions.deleting(msg.id):
+            try:
+                await msg.delete()
+                # the modlog already knows about this one, don't log the delete
+                self.bot.deletions.suppress([msg.id])
+            except discord.NotFound:
+                # deleted by someone else first
+                pass
+            except discord.Forbidden:
+                text = "\N{CROSS MARK} I failed to censor that message because I couldn't delete it."
+                await self.bot.send_modlog(msg.guild, text, priority=True)
 
     async def get_guild_exceptions(self, guild: discord.Guild):
         """ Returns the list of exception role IDs that a guild has. """
-        sql = 'SELECT exceptions FROM censorship WHERE guild_id = $1'
-        async with self.bot.pgpool.acquire() as conn:
-            record = await conn.fetchrow(sql, guild.id)
-            return record['exceptions'] if record else []
+        policy = await self.get_policy(guild)
+        return list(policy.exceptions) if policy else []
 
     async def on_message(self, msg: discord.Message):
         if not isinstance(msg.channel, discord.abc.GuildChannel) or isinstance(msg.author, discord.User):
             # no dms
             return
 
-        if not await self.has_censorship_record(msg.guild):
-            # no censorship record yet!
-            return
+        policy = await self.get_policy(msg.guild)
 
-        censors = (InviteCensorshipFilter, VideositeCensorshipFilter, ZalgoCensorshipFilter,
-                   MediaLinksCensorshipFilter, ExecutableLinksCensorshipFilter, CapsCensorshipFilter,
-                   CrashTextCensorshipFilter)
+        if policy is None or not policy.enabled:
+            # no censorship record yet, or nothing is being censored
+            return
 
         # if the message author has a role that has been excepted, don't even check the message
-        if any([role.id in await self.get_guild_exceptions(msg.guild) for role in msg.author.roles]):
+        if policy.is_excepted(msg.author):
             return
 
         # don't censor myself or other bots
         if msg.author == self.bot.user or msg.author.bot:
             return
 
-        for censorship_filter in censors:
-            if await self.should_censor(msg, censorship_filter):
-                await self.censor_message(msg, censorship_filter)
-
-                # punish the user
-                try:
-                    await self.carry_out_punishment(censorship_filter.censor_type, msg)
-                except discord.Forbidden:
-                    logger.warning('Unable to carry out punishment, forbidden! gid=%d', msg.guild.id)
-                    pass
-                break
+        violations = self.engine.scan(msg.content, policy.enabled, words=policy.words)
+        if not violations:
+            return
+
+        # only act on the most important violation
+        censorship_filter = violations[0]
+        await self.censor_message(msg, censorship_filter)
+
+        # punish the user
+        try:
+            await self.carry_out_punishment(censorship_filter.censor_type, msg)
+        except discord.Forbidden:
+            logger.warning('Unable to carry out punishment, forbidden! gid=%d', msg.guild.id)
+            pass
 
 
 def setup(bot):
@@ -1,2 +1,5 @@
 from .filter import CensorshipFilter
 from .enums import CensorType, PunishmentType
+from .wordlist import WordAutomaton
+from .policy import CensorshipPolicy
+from .engine import CensorshipEngine
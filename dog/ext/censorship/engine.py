@@ -0,0 +1,74 @@
+import typing
+
+from dog.ext.censorship.enums import CensorType
+from dog.ext.censorship.filter import CensorshipFilter
+from dog.ext.censorship.wordlist import WordAutomaton
+
+
+class CensorshipEngine:
+    """
+    Scans message content against many censorship filters at once, without creating a filter or a coroutine per
+    check.
+
+    Filters with a set of ``characters`` are merged into one character table, so content is only scanned once
+    for all of them. Filters with a ``matches`` function, like the link filters, and filters with a ``regex``
+    are run one by one, skipping types that were already found. The regexes are deliberately not merged into
+    one alternation: ``re`` can only skip ahead to a literal prefix when a pattern has one, and an alternation
+    of different prefixes is several times slower than searching for each. Banned words are matched with the
+    guild's own :class:`WordAutomaton`.
+    """
+    def __init__(self, filters: 'Sequence[Type[CensorshipFilter]]'):
+        #: The filters, in order of priority.
+        self.filters = tuple(filters)
+
+        #: A dict of censor types to their filter.
+        self.by_type = {f.censor_type: f for f in self.filters}
+
+        #: A dict of characters to the censor types that forbid them.
+        self.characters = {}
+        for f in self.filters:
+            for char in getattr(f, 'characters', ()):
+                self.characters.setdefault(char, set()).add(f.censor_type)
+
+        self._character_set = frozenset(self.characters)
+
+        #: Filters that check content with their own ``matches`` function.
+        self.matchers = tuple(f for f in self.filters if hasattr(f, 'matches'))
+
+        #: Filters that check content with a ``regex``.
+        self.regexes = tuple(f for f in self.filters if getattr(f, 'regex', None) is not None)
+
+    def scan(self, content: str, types: typing.Iterable[CensorType] = None, *,
+             words: WordAutomaton = None) -> 'List[Type[CensorshipFilter]]':
+        """
+        Returns every filter that some content violates, in order of priority.
+
+        Parameters
+        ----------
+        content
+            The content to scan.
+        types
+            The censor types to check for. Defaults to all of them.
+        words
+            The banned words to check for, if :attr:`CensorType.WORDS` is being checked.
+        """
+        remaining = frozenset(self.by_type if types is None else types)
+        violated = set()
+
+        # banned words
+        if CensorType.WORDS in remaining and words is not None and words.search(content) is not None:
+            violated.add(CensorType.WORDS)
+
+        # characters
+        for char in self._character_set.intersection(content):
+            violated.update(self.characters[char] & remaining)
+
+        # filters that match on their own, then regexes
+        for f in self.matchers:
+            if f.censor_type in remaining and f.matches(content):
+                violated.add(f.censor_type)
+        for f in self.regexes:
+            if f.censor_type in remaining and f.regex.search(content) is not None:
+                violated.add(f.censor_type)
+
+        return [f for f in self.filters if f.censor_type in violated]
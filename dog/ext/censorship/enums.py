@@ -12,6 +12,7 @@ class CensorType(utils.EnumConverter, Enum):
     EXECUTABLELINKS = 5
     CAPS = 6
     CRASH_TEXT = 7
+    WORDS = 8
 
 
 class PunishmentType(utils.EnumConverter, Enum):
@@ -3,7 +3,7 @@ import re
 import discord
 
 from dog.core import utils
-from dog.ext.censorship import CensorshipFilter, CensorType
+from dog.ext.censorship import CensorshipFilter, CensorType, WordAutomaton
 
 
 class ReCensorshipFilter(CensorshipFilter):
@@ -11,13 +11,18 @@ class ReCensorshipFilter(CensorshipFilter):
         return self.regex.search(msg.content) is not None
 
 
-class CrashTextCensorshipFilter(ReCensorshipFilter):
+class CharacterCensorshipFilter(CensorshipFilter):
+    characters: 'FrozenSet[str]' = frozenset()
+
+    async def does_violate(self, msg: discord.Message) -> bool:
+        return not self.characters.isdisjoint(msg.content)
+
+
+class CrashTextCensorshipFilter(CharacterCensorshipFilter):
     censor_type = CensorType.CRASH_TEXT
     mod_log_description = 'Crash text censored'
     show_content = False
-
-    async def does_violate(self, msg):
-        return any(crash in msg.content for crash in ('\U000009e3', '\U0000094c'))
+    characters = frozenset(('\U000009e3', '\U0000094c'))
 
 
 class InviteCensorshipFilter(ReCensorshipFilter):
@@ -29,7 +34,8 @@ class InviteCensorshipFilter(ReCensorshipFilter):
 class VideositeCensorshipFilter(ReCensorshipFilter):
     censor_type = CensorType.VIDEOSITES
     mod_log_description = 'Videosite censored'
-    regex = re.compile(r'(https?://)?(www\.)?(twitch\.tv|youtube\.com)/(.+)')
+    # a scheme and www. are allowed, but don't need to be matched: leaving them out lets re skip ahead to the host
+    regex = re.compile(r'(twitch\.tv|youtube\.com)/(.+)')
 
 
 media_types = ('png', 'webp', 'jpg', 'jpeg', 'gif', 'gifv', 'tif', 'tiff', 'webm', 'mp4', 'mkv', 'mov', 'avi', 'ogg',
@@ -41,31 +47,88 @@ executable_types = ('exe', 'scr', 'app', 'sh', 'terminal', 'pif', 'application',
                     'scf', 'reg')
 
 
-def _link_regex(types: 'Tuple[str]') -> str:
-    return r'(https?://)?([^ ]+)\.([^ ]+)/([^ ]+)\.(' + '|'.join(types) + ')'
+class LinkCensorshipFilter(CensorshipFilter):
+    """
+    Censors links to files with certain extensions: a run of text without spaces that looks like
+    ``host.tld/path/file.ext``, with or without a scheme.
+
+    This used to be the regex ``([^ ]+)\.([^ ]+)/([^ ]+)\.(ext)``, which backtracks from every offset of a long
+    run without spaces. The first dot and the first slash after it are always the best places to split the run
+    at, so they're found with plain string searches, and only the extension needs a regex.
+    """
+    extensions: 'Tuple[str]' = ()
+
+    #: Matches a dot followed by one of the extensions.
+    extension_regex: 'Pattern' = None
+
+    @classmethod
+    def matches(cls, content: str) -> bool:
+        # cheap checks first, most messages don't contain a link at all
+        if '/' not in content or '.' not in content:
+            return False
+
+        for run in content.split(' '):
+            # the host needs at least one character before its dot
+            dot = run.find('.', 1)
+            if dot == -1:
+                continue
+
+            # ...and one after it, before the slash
+            slash = run.find('/', dot + 2)
+            if slash == -1:
+                continue
+
+            # the file name needs at least one character before its extension
+            if cls.extension_regex.search(run, slash + 2) is not None:
+                return True
+        return False
+
+    async def does_violate(self, msg: discord.Message) -> bool:
+        return self.matches(msg.content)
+
+
+def _extension_regex(extensions: 'Tuple[str]') -> 'Pattern':
+    return re.compile(r'\.(?:' + '|'.join(extensions) + ')', re.IGNORECASE)
 
 
-class MediaLinksCensorshipFilter(ReCensorshipFilter):
+class MediaLinksCensorshipFilter(LinkCensorshipFilter):
     censor_type = CensorType.MEDIALINKS
     mod_log_description = 'Image link censored'
-    regex = re.compile(_link_regex(media_types), re.IGNORECASE)
+    extensions = media_types
+    extension_regex = _extension_regex(media_types)
 
 
-class ExecutableLinksCensorshipFilter(ReCensorshipFilter):
+class ExecutableLinksCensorshipFilter(LinkCensorshipFilter):
     censor_type = CensorType.EXECUTABLELINKS
     mod_log_description = 'Link to executable file censored'
-    regex = re.compile(_link_regex(executable_types), re.IGNORECASE)
+    extensions = executable_types
+    extension_regex = _extension_regex(executable_types)
 
 
-class ZalgoCensorshipFilter(CensorshipFilter):
+class ZalgoCensorshipFilter(CharacterCensorshipFilter):
     censor_type = CensorType.ZALGO
     mod_log_description = 'Zalgo censored'
-
-    async def does_violate(self, msg: discord.Message) -> bool:
-        return any(glyph in msg.content for glyph in utils.zalgo_glyphs)
+    characters = frozenset(utils.zalgo_glyphs)
 
 
 class CapsCensorshipFilter(ReCensorshipFilter):
     censor_type = CensorType.CAPS
     mod_log_description = 'Excessive caps censored'
     regex = re.compile(r'[A-Z]{10,}')
+
+
+class WordsCensorshipFilter(CensorshipFilter):
+    censor_type = CensorType.WORDS
+    mod_log_description = 'Banned word censored'
+
+    def __init__(self, words: WordAutomaton = None):
+        self.words = words
+
+    async def does_violate(self, msg: discord.Message) -> bool:
+        return self.words is not None and self.words.search(msg.content) is not None
+
+
+#: All censorship filters, in order of priority.
+default_filters = (InviteCensorshipFilter, VideositeCensorshipFilter, ZalgoCensorshipFilter, MediaLinksCensorshipFilter,
+                   ExecutableLinksCensorshipFilter, CapsCensorshipFilter, CrashTextCensorshipFilter,
+                   WordsCensorshipFilter)
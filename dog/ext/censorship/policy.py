@@ -0,0 +1,61 @@
+import typing
+
+import asyncpg
+import discord
+
+from dog.ext.censorship.enums import CensorType, PunishmentType
+from dog.ext.censorship.wordlist import WordAutomaton
+
+
+class CensorshipPolicy:
+    """
+    Everything needed to decide whether (and how) to censor a message in a guild, compiled from the
+    ``censorship``, ``censorship_punishments`` and ``censorship_words`` tables.
+    """
+    def __init__(self, guild_id: int, *, enabled: typing.Iterable[CensorType], exceptions: typing.Iterable[int],
+                 punishments: typing.Dict[CensorType, PunishmentType], words: typing.Iterable[str] = ()):
+        #: The ID of the guild that this policy is for.
+        self.guild_id = guild_id
+
+        #: The censor types that are enabled.
+        self.enabled = frozenset(enabled)
+
+        #: The IDs of roles that are excepted from being censored.
+        self.exceptions = frozenset(exceptions)
+
+        #: A dict of censor types to the punishment for violating them.
+        self.punishments = punishments
+
+        #: The banned words. Unlike everything else in the policy, this is updated in place.
+        self.words = WordAutomaton(words)
+
+    def __repr__(self):
+        return f'<CensorshipPolicy guild_id={self.guild_id} enabled={self.enabled} exceptions={self.exceptions}>'
+
+    @classmethod
+    async def fetch(cls, conn: asyncpg.connection.Connection, guild_id: int) -> 'Optional[CensorshipPolicy]':
+        """ Compiles the policy for a guild. If the guild has no censorship record, ``None`` is returned. """
+        record = await conn.fetchrow('SELECT enabled, exceptions FROM censorship WHERE guild_id = $1', guild_id)
+        if record is None:
+            return None
+
+        rows = await conn.fetch('SELECT censorship_type, punishment FROM censorship_punishments WHERE guild_id = $1',
+                                guild_id)
+        words = await conn.fetch('SELECT word FROM censorship_words WHERE guild_id = $1', guild_id)
+
+        # ignore names that aren't around anymore
+        enabled = (getattr(CensorType, name, None) for name in record['enabled'] or [])
+        punishments = {getattr(CensorType, row['censorship_type'], None): getattr(PunishmentType, row['punishment'],
+                                                                                   None) for row in rows}
+
+        return cls(guild_id, enabled=filter(None, enabled), exceptions=record['exceptions'] or [],
+                   punishments={k: v for k, v in punishments.items() if k and v},
+                   words=(row['word'] for row in words))
+
+    def is_censoring(self, censor_type: CensorType) -> bool:
+        """ Returns whether a censor type is enabled. """
+        return censor_type in self.enabled
+
+    def is_excepted(self, member: discord.Member) -> bool:
+        """ Returns whether a member has a role that is excepted from being censored. """
+        return not self.exceptions.isdisjoint(role.id for role in member.roles)
@@ -0,0 +1,128 @@
+import typing
+
+
+def normalize(word: str) -> str:
+    """ Normalizes a word (or phrase) for case-insensitive matching. """
+    return ' '.join(word.casefold().split())
+
+
+class WordAutomaton:
+    """
+    An Aho-Corasick automaton over a list of banned words. Searching is linear in the length of the text,
+    no matter how many words there are.
+
+    Adding or removing a word only touches that word's path in the trie. Failure links are recomputed lazily
+    on the next search.
+    """
+    def __init__(self, words: typing.Iterable[str] = ()):
+        #: The normalized words in this automaton.
+        self.words = set()
+
+        # trie nodes, by index. node 0 is the root.
+        self._goto = [{}]
+        self._fail = [0]
+
+        # the length of the word that ends at a node, or 0
+        self._terminal = [0]
+
+        # the lengths of all words that end at a node, including through failure links
+        self._out = [()]
+
+        self._dirty = False
+
+        for word in words:
+            self.add(word)
+
+    def __len__(self):
+        return len(self.words)
+
+    def __contains__(self, word: str):
+        return normalize(word) in self.words
+
+    def __iter__(self):
+        return iter(sorted(self.words))
+
+    def _walk(self, word: str, *, create: bool) -> typing.Optional[int]:
+        node = 0
+        for char in word:
+            child = self._goto[node].get(char)
+            if child is None:
+                if not create:
+                    return None
+                child = self._goto[node][char] = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._terminal.append(0)
+                self._out.append(())
+            node = child
+        return node
+
+    def add(self, word: str) -> bool:
+        """ Adds a word. Returns whether it was added. """
+        word = normalize(word)
+        if not word or word in self.words:
+            return False
+
+        self.words.add(word)
+        self._terminal[self._walk(word, create=True)] = len(word)
+        self._dirty = True
+        return True
+
+    def remove(self, word: str) -> bool:
+        """ Removes a word. Returns whether it was removed. """
+        word = normalize(word)
+        if word not in self.words:
+            return False
+
+        self.words.remove(word)
+        self._terminal[self._walk(word, create=False)] = 0
+        self._dirty = True
+        return True
+
+    def _link(self):
+        """ Computes failure links and outputs with a breadth-first walk of the trie. """
+        queue = []
+        for child in self._goto[0].values():
+            self._fail[child] = 0
+            queue.append(child)
+        self._out[0] = ()
+
+        for node in queue:
+            own = (self._terminal[node],) if self._terminal[node] else ()
+            self._out[node] = own + self._out[self._fail[node]]
+
+            for char, child in self._goto[node].items():
+                fallback = self._fail[node]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(char, 0)
+                queue.append(child)
+
+        self._dirty = False
+
+    def search(self, text: str) -> typing.Optional[str]:
+        """
+        Returns the first word found in some text, or ``None``. Words only match on their own, so "ass" does not
+        match "class".
+        """
+        if not self.words:
+            return None
+        if self._dirty:
+            self._link()
+
+        text = ' '.join(text.casefold().split())
+        goto, fail, out = self._goto, self._fail, self._out
+        node = 0
+
+        for index, char in enumerate(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+
+            for length in out[node]:
+                start = index - length + 1
+                if (start == 0 or not text[start - 1].isalnum()) and \
+                        (index + 1 == len(text) or not text[index + 1].isalnum()):
+                    return text[start:index + 1]
+
+        return None
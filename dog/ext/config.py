@@ -8,6 +8,7 @@ import asyncpg
 from discord.ext import commands
 
 from dog import Cog
+from dog.core.guildconfig import CONFIG_KEYS
 
 log = logging.getLogger(__name__)
 CONFIGKEYS_HELP = '<https://github.com/slice/dogbot/wiki/Configuration>'
@@ -22,17 +23,7 @@ class Prefix(commands.Converter):
 
 class Config(Cog):
     #: A list of permitted configuration keys.
-    PERMITTED_KEYS = (
-        'invisible_nag',
-        'modlog_filter_allow_bot',
-        'welcome_message',
-        'modlog_notrack_deletes',
-        'modlog_notrack_edits',
-        'modlog_channel_id',
-        'pollr_mod_log',
-        'log_all_message_events',
-        'shortlinks_enabled'
-    )
+    PERMITTED_KEYS = CONFIG_KEYS
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -56,7 +47,7 @@ class Config(Cog):
         if name not in self.PERMITTED_KEYS:
             return await ctx.send(await ctx._('cmd.config.set.invalid', wikipage=CONFIGKEYS_HELP))
 
-        await self.bot.redis.set(f'{ctx.guild.id}:{name}', value)
+        await self.bot.config_set(ctx.guild, name, value)
         await ctx.ok()
 
     @config.command(name='permitted')
@@ -74,7 +65,7 @@ class Config(Cog):
     @config.command(name='list', aliases=['ls'])
     async def config_list(self, ctx):
         """ Lists set configuration keys for this server. """
-        keys = [k.decode().split(':')[1] async for k in self.bot.redis.iscan(match=f'{ctx.guild.id}:*')]
+        keys = list(await self.bot.config_cache.snapshot(ctx.guild.id))
         if not keys:
             return await ctx.send(await ctx._('cmd.config.list.none'))
         await ctx.send('Set configuration keys in this server: ' + ', '.join(keys))
@@ -82,7 +73,7 @@ class Config(Cog):
     @config.command(name='remove', aliases=['rm', 'del', 'delete'])
     async def config_remove(self, ctx, name: str):
         """ Removes a config field for this server. """
-        await self.bot.redis.delete(f'{ctx.guild.id}:{name}')
+        await self.bot.config_remove(ctx.guild, name)
         await ctx.ok()
 
     @config.command(name='get', aliases=['cat'])
@@ -92,8 +83,8 @@ class Config(Cog):
             await ctx.send('That config field is not set.')
             return
         else:
-            value = await self.bot.redis.get(f'{ctx.guild.id}:{name}')
-            await ctx.send(f'`{name}`: {value.decode()}')
+            value = await self.bot.config_get(ctx.guild, name)
+            await ctx.send(f'`{name}`: {value}')
 
     @commands.group()
     @commands.guild_only()
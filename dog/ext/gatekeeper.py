@@ -1,3 +1,4 @@
+import asyncio
 import datetime
 import re
 
@@ -7,6 +8,10 @@ from discord.ext import commands
 from dog import Cog
 from dog.core import checks, context, utils
 from dog.core.utils import describe
+from dog.core.utils.regex import RegexSandbox, UnsafePattern
+
+#: Runs guild-supplied username regexes with a time limit.
+regex_sandbox = RegexSandbox()
 
 
 class Block(Exception):
@@ -60,11 +65,20 @@ class UsernameRegexCheck(GatekeeperCheck):
 
     async def check(self, regex: str, member: discord.Member) -> bool:
         try:
-            regex = re.compile(regex)
-            if regex.search(member.name):
-                raise Block('Matched username regex')
-        except re.error as err:
+            matched = await regex_sandbox.search(regex, member.name, key=member.guild.id)
+        except (re.error, UnsafePattern) as err:
             raise Report(f"\N{CROSS MARK} `username_regex` was invalid: `{err}`, ignoring this check.")
+        except asyncio.TimeoutError:
+            raise Report(f"\N{CROSS MARK} `username_regex` took too long to match against {describe(member)}, "
+                         "ignoring this check. Try simplifying it.")
+        except asyncio.CancelledError:
+            raise
+        except Exception as err:
+            # like the worker process dying
+            raise Report(f"\N{CROSS MARK} `username_regex` couldn't be checked: `{err!r}`, ignoring this check.")
+
+        if matched:
+            raise Block('Matched username regex')
 
 
 class Gatekeeper(Cog):
@@ -76,6 +90,9 @@ class Gatekeeper(Cog):
         'username_regex',         # username regex
     )
 
+    def __unload(self):
+        regex_sandbox.shutdown()
+
     async def __local_check(self, ctx):
         return ctx.guild and checks.member_is_moderator(ctx.author)
 
@@ -205,6 +222,12 @@ class Gatekeeper(Cog):
             keys = ', '.join(f'`{key}`' for key in self.CUSTOMIZATION_KEYS)
             return await ctx.send(f'Invalid key. Valid keys: {keys}')
 
+        if key == 'username_regex':
+            try:
+                regex_sandbox.validate(value)
+            except (re.error, UnsafePattern) as err:
+                return await ctx.send(f'\N{CROSS MARK} That regex is invalid: `{err}`')
+
         hash_key = f'gatekeeper:{ctx.guild.id}:settings'
         await ctx.bot.redis.hset(hash_key, key, value)
         await ctx.send(f'\N{OK HAND SIGN} Set `{key}` to `{value}`.')
@@ -11,22 +11,15 @@ import psutil
 from discord.ext import commands
 from dog import Cog
 from dog.core import utils, converters
-from dog.core.utils.formatting import describe
+from dog.core.guildconfig import migrate_legacy_keys
 
 logger = logging.getLogger(__name__)
 
 
 class Internal(Cog):
-    def __init__(self, bot):
-        super().__init__(bot)
-        self.socket_events = 0
-
     async def __local_check(self, ctx):
         return await self.bot.is_owner(ctx.message.author)
 
-    async def on_socket_raw_receive(self, _):
-        self.socket_events += 1
-
     @commands.command()
     async def dstats(self, ctx):
         """ Shows detailed stats. """
@@ -55,12 +48,46 @@ class Internal(Cog):
         clients = ctx.bot.voice_clients
         embed.add_field(name='Voice', value=f'{len(clients)} voice client(s)')
 
+        # config cache
+        cache = ctx.bot.config_cache
+        embed.add_field(name='Config cache', value=f'{utils.commas(len(cache))} guild(s)\n'
+                                                   f'{utils.commas(cache.hits)} hits, {utils.commas(cache.misses)} '
+                                                   f'misses\n{round(cache.hit_rate * 100, 2)}% hit rate')
+
         async with ctx.acquire() as conn:
             record = await conn.fetchrow('SELECT SUM(times_used) FROM command_statistics')
-            embed.add_field(name='Commands Ran', value=utils.commas(record['sum']) + ' total')
+
+        # include uses that haven't been written yet
+        stats = ctx.bot.get_cog('Stats')
+        total = (record['sum'] or 0) + (stats.writer.pending_uses if stats else 0)
+        embed.add_field(name='Commands Ran', value=utils.commas(total) + ' total')
 
         await ctx.send(embed=embed)
 
+    @commands.command()
+    async def migrate_config(self, ctx):
+        """
+        Migrates guild configuration to one Redis hash per guild.
+
+        Configuration keys used to be stored as separate "<guild id>:<name>" keys. This moves any that are left
+        into "guild_config:<guild id>" hashes. It is safe to run while the bot is running.
+
+        The bot does this by itself the first time it starts. This is for keys that were written by older
+        processes afterwards, like during a rolling deploy.
+        """
+        msg = await ctx.send('\U000023f3 Migrating...')
+        result = await migrate_legacy_keys(ctx.bot.redis)
+
+        # drop the (now stale) snapshots of the guilds we touched
+        for guild_id in result.guilds:
+            await ctx.bot.config_changed(discord.Object(id=guild_id))
+
+        saved = result.bytes_before - result.bytes_after
+        await msg.edit(content=f'{ctx.green_tick} Migrated {utils.commas(result.keys)} key(s) from '
+                               f'{utils.commas(len(result.guilds))} guild(s). Memory: '
+                               f'{utils.filesize(result.bytes_before)} \N{RIGHTWARDS ARROW} '
+                               f'{utils.filesize(result.bytes_after)} ({utils.filesize(saved)} saved)')
+
     @commands.command(aliases=['bl'])
     async def blacklist(self, ctx, guild: int):
         """
@@ -89,43 +116,17 @@ class Internal(Cog):
     @globalbans.command(name='flush')
     async def gb_flush(self, ctx):
         """
-        Flushes the global ban cache.
-
-        When someone speaks, Dogbot fetches whether that person has been banned or not, and stores
-        that value in Redis for 2 hours. When the value expires, Dogbot checks again. But while we
-        have the cached value during that 2 hour period, we go off of that instead of the actual banned
-        value. That is why there is "ban cached" and "actually banned". When we create a ban, the cached
-        value for that user is instantly invalidated, so the ban takes effect immediately. However, unbans do
-        not invalidate cache. With this command, Dogbot will check all cached bans and check if they are actually
-        banned. If they are, the cached value is removed so unbans will take effect immediately.
-        """
-        results = []
-
-        async for key in ctx.bot.redis.iscan(match='cache:globalbans:*'):
-            if (await ctx.bot.redis.get(key.decode())).decode() == 'not banned':
-                logger.debug('Ignoring present "not banned" cache value (%s).', key.decode())
-                continue
-
-            id = int(key.decode().split(':')[2])
-            logger.debug('Flushing ban for %s (%d)', key.decode(), id)
+        Reloads the global ban cache.
 
-            user = ctx.bot.get_user(id)
-            if not user:
-                # wat
-                results.append(f'\N{CROSS MARK} Could not resolve user `{id}`, not flushed.')
-                continue
-
-            async with ctx.acquire() as conn:
-                ban_row = await conn.fetchrow('SELECT * FROM globalbans WHERE user_id = $1', user.id)
-
-            if ban_row is None:
-                results.append(f'{ctx.green_tick} Removed ban for {describe(user)}')
-                await ctx.bot.redis.delete(key.decode())
-                logger.debug('Removing ban for %s (%s) as part of flush operation.', key.decode(), user)
-            else:
-                results.append(f'\N{HAMMER} Persisting ban for {describe(user)}, still banned!')
-
-        await ctx.send('\n'.join(results) if results else 'Nothing happened.')
+        Dogbot keeps the set of globally banned users in memory, so it doesn't have to check the database
+        every time someone speaks. Adding or removing a global ban updates that set in every process
+        immediately. This command reloads it from the database, in case it has drifted somehow.
+        """
+        before = set(ctx.bot.global_bans)
+        await ctx.bot.load_global_bans()
+        added, removed = ctx.bot.global_bans - before, before - ctx.bot.global_bans
+        await ctx.send(f'Reloaded {len(ctx.bot.global_bans)} global ban(s). {len(added)} added, {len(removed)} '
+                       'removed.')
 
     @globalbans.command(name='add')
     async def gb_add(self, ctx, who: converters.RawMember, *, reason):
@@ -136,21 +137,19 @@ class Internal(Cog):
                 await conn.execute(sql, who.id, reason, datetime.datetime.utcnow())
             except asyncpg.UniqueViolationError:
                 return await ctx.send('That user has already been global banned.')
-        # invalidate cache
-        logger.info('%s was just global banned, invalidating cached value.')
-        await ctx.bot.redis.delete(f'cache:globalbans:{who.id}')
+        logger.info('%d was just global banned, updating cache.', who.id)
+        await ctx.bot.set_global_ban(who.id, True)
         await ctx.ok()
 
     @globalbans.command(name='status')
     async def gb_status(self, ctx, who: converters.RawMember):
         """ Checks on global ban status. """
-        is_banned = await ctx.bot.is_global_banned(who)
-        is_banned_cached = (await ctx.bot.redis.get(f'cache:globalbans:{who.id}')).decode() == 'banned'
+        is_banned_cached = await ctx.bot.is_global_banned(who)
 
         async with ctx.acquire() as conn:
             actual_ban = await conn.fetchrow('SELECT * FROM globalbans WHERE user_id = $1', who.id)
 
-        embed = discord.Embed(color=(discord.Color.red() if is_banned else discord.Color.green()))
+        embed = discord.Embed(color=(discord.Color.red() if actual_ban is not None else discord.Color.green()))
         embed.set_author(name=who, icon_url=who.avatar_url_as(format='png'))
         embed.add_field(name='Ban cached', value='Yes' if is_banned_cached else 'No')
         embed.add_field(name='Actually banned', value='Yes' if actual_ban is not None else 'No')
@@ -166,6 +165,7 @@ class Internal(Cog):
         """ Removes a global ban. """
         async with ctx.acquire() as conn:
             await conn.execute('DELETE FROM globalbans WHERE user_id = $1', who.id)
+        await ctx.bot.set_global_ban(who.id, False)
         await ctx.ok()
 
 
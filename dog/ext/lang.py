@@ -1,7 +1,3 @@
-import os
-import pathlib
-
-import discord
 from discord.ext import commands
 from dog import Cog
 
@@ -12,7 +8,7 @@ class LangConverter(commands.Converter):
             return ''
         if len(arg) != 5:
             raise commands.BadArgument('Languages are 5 letters long, like so: `en-US`')
-        if not os.path.isfile(f'./resources/lang/{arg}.yml'):
+        if arg not in ctx.bot.lang_catalog.languages:
             raise commands.BadArgument('That language isn\'t supported.')
         return arg
 
@@ -32,8 +28,7 @@ class Lang(Cog):
     @commands.command()
     async def langs(self, ctx):
         """ Lists supported languages. """
-        langs = [p.stem for p in pathlib.Path('./resources/lang/').glob('*.yml')]
-        await ctx.send(', '.join(langs))
+        await ctx.send(', '.join(ctx.bot.lang_catalog.languages))
 
     @commands.command(aliases=['ssl'])
     @commands.guild_only()
@@ -1,16 +1,42 @@
+import asyncio
 import datetime
 import functools
+import gzip
 import json
 import logging
 import re
+import tempfile
+import time
+import typing
 
+import asyncpg
 import discord
 from discord.ext import commands
+from discord.utils import snowflake_time
 from dog import Cog
 from dog.core import checks, converters, utils
+from dog.core.utils import BatchWriter
 
 logger = logging.getLogger(__name__)
 
+#: Matches the Redis keys of guilds that have logging enabled.
+ENABLED_KEY_REGEX = re.compile(r'message_logging:(\d+):enabled')
+
+#: The longest to wait before trying to load the guilds with logging enabled again, in seconds.
+MAX_LOAD_BACKOFF = 60
+
+#: Matches the names of monthly partitions of the messages table.
+PARTITION_REGEX = re.compile(r'messages_y(\d{4})m(\d{2})')
+
+#: How often partitions are maintained, in seconds.
+PARTITION_MAINTENANCE_INTERVAL = 60 * 60 * 6
+
+#: How many rows an export fetches from the database at a time.
+EXPORT_PREFETCH = 500
+
+#: The largest file that can be uploaded to Discord, in bytes.
+UPLOAD_LIMIT = 8 * 1024 * 1024
+
 
 def require_logging_enabled(func):
     @functools.wraps(func)
@@ -20,7 +46,7 @@ def require_logging_enabled(func):
             return
 
         # args[0] = self, args[1] = msg
-        if not await args[0].bot.redis.exists(f'message_logging:{args[1].guild.id}:enabled'):
+        if not await args[0].is_logging(args[1].guild):
             return
 
         # don't log ourselves
@@ -74,38 +100,362 @@ def postprocess_message_content(content):
     return utils.prevent_codeblock_breakout(content.replace('\x00', ''))
 
 
+#: The content that is shown for a logged message: the edited content if there is any, otherwise the original.
+#: Matches the expression that the trigram and full-text indexes on messages are built on.
+CONTENT_SQL = "coalesce(nullif(new_content, ''), original_content)"
+
+
+def escape_like(value: str) -> str:
+    """ Escapes LIKE wildcards in a string. """
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def archive_query(flags: dict, *, guild_id: int, author_id: int = None, channel_id: int = None, limit: int = None,
+                  chronological: bool = False) -> typing.Tuple[str, list]:
+    """
+    Compiles archive flags into a query for logged messages in a guild. Returns the query and its arguments.
+
+    Messages are ordered newest first, or by relevance when searching. If ``chronological`` is ``True``, they
+    are always ordered oldest first.
+
+    Raises
+    ------
+    ValueError
+        A flag value is invalid.
+    """
+    args = []
+    clauses = []
+
+    def arg(value) -> str:
+        args.append(value)
+        return f'${len(args)}'
+
+    clauses.append(f'guild_id = {arg(guild_id)}')
+    if author_id is not None:
+        clauses.append(f'author_id = {arg(author_id)}')
+    if channel_id is not None:
+        clauses.append(f'channel_id = {arg(channel_id)}')
+
+    if 'has-attachments' in flags:
+        clauses.append("attachments @> '[{}]'::jsonb")
+    if 'edited' in flags:
+        clauses.append('edited')
+    if 'deleted' in flags:
+        clauses.append('deleted')
+    if 'channel' in flags:
+        clauses.append(f'channel_id = {arg(int(flags["channel"]))}')
+    if 'mentions' in flags:
+        clauses.append(f"{CONTENT_SQL} ~ ('<@!?' || {arg(str(int(flags['mentions'])))} || '>')")
+    if 'contains' in flags:
+        clauses.append(f"{CONTENT_SQL} ILIKE '%' || {arg(escape_like(str(flags['contains'])))} || '%'")
+
+    order = 'created_at' if chronological else 'created_at DESC'
+    if 'search' in flags:
+        query = arg(str(flags['search']))
+        document = f"to_tsvector('english', {CONTENT_SQL})"
+        clauses.append(f"{document} @@ websearch_to_tsquery('english', {query})")
+        if not chronological:
+            order = f"ts_rank({document}, websearch_to_tsquery('english', {query})) DESC, {order}"
+
+    sql = f'SELECT * FROM messages WHERE {" AND ".join(clauses)} ORDER BY {order}'
+    if limit is not None:
+        sql += f' LIMIT {arg(limit)}'
+    return sql, args
+
+
+def record_to_dict(record) -> dict:
+    """ Converts a messages row into something that can be dumped as JSON. """
+    data = dict(record)
+    for key in ('created_at', 'edited_at', 'deleted_at'):
+        data[key] = data[key] and data[key].isoformat()
+    data['attachments'] = json.loads(data['attachments'] or '[]')
+    return data
+
+
+class ExportTarget(commands.Converter):
+    """ Resolves a text channel, or a user. """
+    async def convert(self, ctx, argument):
+        try:
+            return await commands.TextChannelConverter().convert(ctx, argument)
+        except commands.BadArgument:
+            return await converters.RawUser().convert(ctx, argument)
+
+
+def add_months(date: datetime.date, months: int) -> datetime.date:
+    """ Returns the first day of the month that is some amount of months away from a date. """
+    index = date.year * 12 + date.month - 1 + months
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+async def maintain_partitions(conn, retention_months: int = None) -> typing.List[str]:
+    """
+    Creates the partitions of the messages table for this month and next month, then drops partitions whose
+    whole month is older than ``retention_months``. Returns the names of the dropped partitions.
+    """
+    this_month = datetime.datetime.utcnow().date().replace(day=1)
+    for month in (this_month, add_months(this_month, 1)):
+        await conn.execute('SELECT create_messages_partition($1)', month)
+
+    if not retention_months:
+        return []
+
+    partitions_sql = """
+        SELECT child.relname FROM pg_inherits
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE parent.relname = 'messages'
+    """
+    oldest_kept = add_months(this_month, -retention_months)
+    dropped = []
+
+    for record in await conn.fetch(partitions_sql):
+        match = PARTITION_REGEX.fullmatch(record['relname'])
+        if not match or datetime.date(int(match.group(1)), int(match.group(2)), 1) >= oldest_kept:
+            continue
+
+        # the name was matched above, so it's safe to put in the query
+        await conn.execute(f'DROP TABLE {match.group(0)}')
+        dropped.append(match.group(0))
+
+    return dropped
+
+
+class MessageWriter(BatchWriter):
+    """
+    Writes logged messages in batches. New messages are written with COPY, and edits and deletes are
+    coalesced by message ID into one UPDATE each. Edits and deletes of messages that haven't been written yet
+    are folded into the new message instead.
+    """
+    #: The columns of ``messages`` that new messages are copied into, in order.
+    COLUMNS = ('message_id', 'guild_id', 'channel_id', 'author_id', 'original_content', 'new_content',
+               'attachments', 'deleted', 'edited', 'deleted_at', 'edited_at', 'created_at')
+
+    def __init__(self, bot):
+        super().__init__(bot, 'Message logging')
+
+        # message id -> row (a list, in COLUMNS order)
+        self._inserts = {}
+
+        # message id -> (new content, edited at)
+        self._edits = {}
+
+        # message id -> deleted at
+        self._deletes = {}
+
+    def __len__(self):
+        return len(self._inserts) + len(self._edits) + len(self._deletes)
+
+    def take(self):
+        batch = (list(self._inserts.values()), self._edits, self._deletes)
+        self._inserts, self._edits, self._deletes = {}, {}, {}
+        return batch
+
+    async def insert(self, msg: discord.Message):
+        await self.make_room()
+        encoded_attachments = json.dumps([attachment_to_dict(tch) for tch in msg.attachments])
+        content = postprocess_message_content(msg.content)
+        self._inserts[msg.id] = [msg.id, msg.guild.id, msg.channel.id, msg.author.id, content, '',
+                                 encoded_attachments, False, False, None, None, msg.created_at]
+        self.buffered()
+
+    async def edit(self, message_id: int, content: str, edited_at: datetime.datetime):
+        await self.make_room()
+        content = postprocess_message_content(content)
+        row = self._inserts.get(message_id)
+        if row is not None:
+            row[5], row[8], row[10] = content, True, edited_at
+        else:
+            self._edits[message_id] = (content, edited_at)
+        self.buffered()
+
+    async def delete(self, message_id: int, deleted_at: datetime.datetime):
+        await self.make_room()
+        row = self._inserts.get(message_id)
+        if row is not None:
+            row[7], row[9] = True, deleted_at
+        else:
+            self._deletes[message_id] = deleted_at
+        self.buffered()
+
+    async def write(self, batch):
+        inserts, edits, deletes = batch
+
+        async with self.bot.pgpool.acquire() as conn:
+            async with conn.transaction():
+                if inserts:
+                    await conn.copy_records_to_table('messages', records=inserts, columns=self.COLUMNS)
+
+                # the created_at of a message is part of its snowflake. matching on it (and on the range of the
+                # whole batch) lets postgres skip the partitions that none of the messages are in, instead of
+                # probing every month's index for every row
+                if edits:
+                    update_sql = """
+                        UPDATE messages SET edited = TRUE, new_content = u.new_content, edited_at = u.edited_at
+                        FROM unnest($1::bigint[], $2::timestamp[], $3::text[], $4::timestamp[])
+                            AS u(message_id, created_at, new_content, edited_at)
+                        WHERE messages.message_id = u.message_id AND messages.created_at = u.created_at
+                            AND messages.created_at BETWEEN $5 AND $6
+                    """
+                    created = [snowflake_time(message_id) for message_id in edits]
+                    contents, times = zip(*edits.values())
+                    await conn.execute(update_sql, list(edits), created, contents, times, min(created), max(created))
+
+                if deletes:
+                    delete_sql = """
+                        UPDATE messages SET deleted = TRUE, deleted_at = u.deleted_at
+                        FROM unnest($1::bigint[], $2::timestamp[], $3::timestamp[])
+                            AS u(message_id, created_at, deleted_at)
+                        WHERE messages.message_id = u.message_id AND messages.created_at = u.created_at
+                            AND messages.created_at BETWEEN $4 AND $5
+                    """
+                    created = [snowflake_time(message_id) for message_id in deletes]
+                    await conn.execute(delete_sql, list(deletes), created, list(deletes.values()), min(created),
+                                       max(created))
+
+        self._log('debug', 'Wrote %d new, %d edited, %d deleted.', len(inserts), len(edits), len(deletes))
+
+    async def salvage(self, batch) -> int:
+        # write every row on its own, so a bad one only loses itself. new messages are upserted, in case one of
+        # them was what made the COPY fail
+        inserts, edits, deletes = batch
+        columns = ', '.join(self.COLUMNS)
+        placeholders = ', '.join(f'${index}' for index in range(1, len(self.COLUMNS) + 1))
+        insert_sql = f"""
+            INSERT INTO messages ({columns}) VALUES ({placeholders})
+            ON CONFLICT (message_id, created_at) DO UPDATE SET
+                new_content = CASE WHEN EXCLUDED.edited THEN EXCLUDED.new_content ELSE messages.new_content END,
+                edited = messages.edited OR EXCLUDED.edited,
+                edited_at = coalesce(EXCLUDED.edited_at, messages.edited_at),
+                deleted = messages.deleted OR EXCLUDED.deleted,
+                deleted_at = coalesce(EXCLUDED.deleted_at, messages.deleted_at)
+        """
+        edit_sql = """
+            UPDATE messages SET edited = TRUE, new_content = $3, edited_at = $4
+            WHERE message_id = $1 AND created_at = $2
+        """
+        delete_sql = 'UPDATE messages SET deleted = TRUE, deleted_at = $3 WHERE message_id = $1 AND created_at = $2'
+
+        statements = ([(insert_sql, row) for row in inserts] +
+                      [(edit_sql, (message_id, snowflake_time(message_id), *edit))
+                       for message_id, edit in edits.items()] +
+                      [(delete_sql, (message_id, snowflake_time(message_id), deleted_at))
+                       for message_id, deleted_at in deletes.items()])
+
+        lost = 0
+        async with self.bot.pgpool.acquire() as conn:
+            for sql, args in statements:
+                try:
+                    await conn.execute(sql, *args)
+                except asyncpg.PostgresError:
+                    self._log('exception', 'Failed to write a row, dropping it. args=%r', args[:1])
+                    lost += 1
+        return lost
+
+
 class MessageLogging(Cog):
+    def __init__(self, bot):
+        super().__init__(bot)
+        self.writer = MessageWriter(bot)
+
+        #: IDs of guilds that have logging enabled, kept in sync through broadcasts.
+        self.enabled_guilds = set()
+        self.enabled_guilds_loaded = asyncio.Event()
+        self.enabled_guilds_loader = bot.loop.create_task(self.load_enabled_guilds())
+
+        #: How many whole months of logged messages to keep. If ``None``, they are kept forever.
+        self.retention_months = bot.cfg.get('message_logging', {}).get('retention_months')
+
+        self.partition_maintainer = bot.loop.create_task(self.maintain_partitions())
+
+    def __unload(self):
+        # flush what's left in the background, the new writer takes over from here
+        self.bot.loop.create_task(self.writer.close())
+        self.partition_maintainer.cancel()
+        self.enabled_guilds_loader.cancel()
+
+    async def load_enabled_guilds(self):
+        """
+        Loads the set of guilds that have logging enabled from Redis. If that fails, it's tried again with
+        exponential backoff until it works.
+        """
+        backoff = 1
+
+        while True:
+            try:
+                enabled_guilds = set()
+                async for key in self.bot.redis.iscan(match='message_logging:*:enabled'):
+                    match = ENABLED_KEY_REGEX.fullmatch(key.decode())
+                    if match:
+                        enabled_guilds.add(int(match.group(1)))
+                break
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.logger.exception('Failed to load guilds with logging enabled, trying again in %d second(s).',
+                                      backoff)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, MAX_LOAD_BACKOFF)
+
+        self.enabled_guilds = enabled_guilds
+        self.enabled_guilds_loaded.set()
+        self.logger.info('Loaded %d guild(s) with logging enabled.', len(enabled_guilds))
+
+    async def is_logging(self, guild: discord.Guild) -> bool:
+        """
+        Returns whether a guild has logging enabled. This doesn't touch the network once the set of guilds with
+        logging enabled has been loaded. Until then, Redis is asked directly.
+        """
+        if not self.enabled_guilds_loaded.is_set():
+            return await self.bot.redis.exists(f'message_logging:{guild.id}:enabled')
+        return guild.id in self.enabled_guilds
+
+    async def set_logging(self, guild: discord.Guild, enabled: bool):
+        """
+        Updates whether a guild has logging enabled in this process, and broadcasts the change to the others.
+
+        .. NOTE::
+
+            This does not touch Redis, the caller is expected to have done that already.
+        """
+        await self.on_broadcast_message_logging({'guild_id': guild.id, 'enabled': enabled})
+        await self.bot.broadcast('message_logging', {'guild_id': guild.id, 'enabled': enabled})
+
+    async def on_broadcast_message_logging(self, data):
+        if data['enabled']:
+            self.enabled_guilds.add(data['guild_id'])
+        else:
+            self.enabled_guilds.discard(data['guild_id'])
+
+    async def on_broadcasts_resubscribed(self):
+        await self.load_enabled_guilds()
+
+    async def maintain_partitions(self):
+        while True:
+            try:
+                async with self.bot.pgpool.acquire() as conn:
+                    dropped = await maintain_partitions(conn, self.retention_months)
+                if dropped:
+                    self.logger.info('Dropped expired message partitions: %s', ', '.join(dropped))
+            except Exception:
+                self.logger.exception('Failed to maintain message partitions.')
+            await asyncio.sleep(PARTITION_MAINTENANCE_INTERVAL)
+
     @require_logging_enabled
     async def on_message(self, msg):
-        async with self.bot.pgpool.acquire() as conn:
-            insertion_sql = """
-                INSERT INTO messages (message_id, guild_id, channel_id, author_id, original_content, new_content,
-                    attachments, deleted, edited, deleted_at, edited_at, created_at)
-                VALUES ($1, $2, $3, $4, $5, '', $6, FALSE, FALSE, NULL, NULL, $7);
-            """
-            encoded_attachments = json.dumps([attachment_to_dict(tch) for tch in msg.attachments])
-            content = postprocess_message_content(msg.content)
-            await conn.execute(insertion_sql, msg.id, msg.guild.id, msg.channel.id, msg.author.id, content,
-                               encoded_attachments, msg.created_at)
+        await self.writer.insert(msg)
 
     @require_logging_enabled
     async def on_message_edit(self, before, after):
-        async with self.bot.pgpool.acquire() as conn:
-            update_sql = """
-                UPDATE messages SET edited = TRUE, new_content = $1, edited_at = $3 WHERE message_id = $2
-            """
-            content = postprocess_message_content(after.content)
-            await conn.execute(update_sql, content, before.id, datetime.datetime.utcnow())
+        # embeds being resolved and pins also dispatch edits, there's nothing to log for those
+        if before.content == after.content:
+            return
+        await self.writer.edit(before.id, after.content, datetime.datetime.utcnow())
 
     @require_logging_enabled
     async def on_message_delete(self, msg):
-        async with self.bot.pgpool.acquire() as conn:
-            delete_sql = """
-                UPDATE messages SET deleted = TRUE, deleted_at = $2 WHERE message_id = $1
-            """
-            await conn.execute(delete_sql, msg.id, datetime.datetime.utcnow())
+        await self.writer.delete(msg.id, datetime.datetime.utcnow())
 
-    @commands.command()
+    @commands.group(invoke_without_command=True)
     @checks.is_moderator()
     async def archive(self, ctx, user: discord.User, amount: int, *, flags: converters.Flags={}):
         """
@@ -113,40 +463,19 @@ class MessageLogging(Cog):
 
         Only Dogbot Moderators can do this.
 
-        The amount you specify is not equal to the amount of messages that will be shown to you.
-        Rather, it will be the amount of messages that are fetched from the bot's database.
-
         Flags allow you to specify which messages you want to see, or how you want to see them.
+        --search="some words" searches messages, and shows the best matches first.
         For more information, see https://github.com/slice/dogbot/wiki/Message-Logging.
         """
+        fetch_sql, args = archive_query(flags, guild_id=ctx.guild.id, author_id=user.id, limit=amount)
         async with ctx.acquire() as conn:
-            fetch_sql = """
-                SELECT * FROM messages WHERE author_id = $1 AND guild_id = $2 ORDER BY created_at DESC LIMIT $3
-            """
-            messages = await conn.fetch(fetch_sql, user.id, ctx.guild.id, amount)
+            messages = await conn.fetch(fetch_sql, *args)
 
         paginator = commands.Paginator()
 
-        flag_processors = {
-            'has-attachments': lambda value, msg: json.loads(msg['attachments']),
-            'contains': lambda value, msg: value in msg,
-            'edited': lambda value, msg: msg['edited'],
-            'deleted': lambda value, msg: msg['deleted'],
-            'channel': lambda value, msg: msg['channel_id'] == int(value),
-            'mentions': lambda value, msg: re.search(f'<@!?{value}>', content) is None
-        }
-
         # add messages
         for msg in messages:
-            content = msg['new_content'] or msg['original_content']
-
-            failed_flags = False
-            for flag_name, processor in flag_processors.items():
-                if flag_name in flags and not processor(flags[flag_name], msg):
-                    failed_flags = True
-
-            if not failed_flags:
-                paginator.add_line(format_record(msg, flags))
+            paginator.add_line(format_record(msg, flags))
 
         # send pages
         if not paginator.pages:
@@ -154,6 +483,49 @@ class MessageLogging(Cog):
         for page in paginator.pages:
             await ctx.send(page)
 
+    @archive.command(name='export')
+    @checks.is_moderator()
+    async def archive_export(self, ctx, target: ExportTarget, *, flags: converters.Flags={}):
+        """
+        Exports every logged message from a user or channel.
+
+        Only Dogbot Moderators can do this.
+
+        Messages are uploaded as a gzipped file with one JSON object per line, oldest first. The same flags as
+        d?archive can be used to narrow down which messages are exported.
+        """
+        if isinstance(target, discord.TextChannel):
+            fetch_sql, args = archive_query(flags, guild_id=ctx.guild.id, channel_id=target.id, chronological=True)
+        else:
+            fetch_sql, args = archive_query(flags, guild_id=ctx.guild.id, author_id=target.id, chronological=True)
+
+        rows = 0
+        started = time.monotonic()
+
+        # rows are streamed from a cursor into a compressed file on disk, so memory use doesn't depend on how
+        # many rows there are
+        with tempfile.TemporaryFile() as fp:
+            async with ctx.typing():
+                with gzip.GzipFile(fileobj=fp, mode='wb') as gz:
+                    async with ctx.acquire() as conn, conn.transaction():
+                        async for record in conn.cursor(fetch_sql, *args, prefetch=EXPORT_PREFETCH):
+                            gz.write(json.dumps(record_to_dict(record)).encode() + b'\n')
+                            rows += 1
+
+            elapsed = time.monotonic() - started
+            size = fp.tell()
+            summary = (f'{rows:,} message(s) in {elapsed:.2f}s ({rows / max(elapsed, 0.001):,.0f} rows/s), '
+                       f'{utils.filesize(size)} compressed.')
+
+            if not rows:
+                return await ctx.send('```No results.```')
+            if size > UPLOAD_LIMIT:
+                return await ctx.send(f'{summary} That\'s too big to upload, try narrowing it down with flags.')
+
+            fp.seek(0)
+            await ctx.send(summary, file=discord.File(fp, filename=f'{target.id}_messages.jsonl.gz'))
+
+    @archive_export.error
     @archive.error
     async def archive_error(self, ctx, err):
         original = None if not isinstance(err, commands.CommandInvokeError) else err.original
@@ -177,6 +549,7 @@ class MessageLogging(Cog):
         else:
             await ctx.bot.redis.delete(key)
 
+        await self.set_logging(ctx.guild, enable)
         await ctx.ok()
 
 
@@ -171,11 +171,10 @@ class Mod(Cog):
         await ctx.send('I couldn\'t find the data from the audit logs. Sorry!')
 
     async def on_member_join(self, member):
-        if not await self.bot.config_is_set(member.guild, 'welcome_message'):
+        welcome_message = await self.bot.config_get(member.guild, 'welcome_message')
+        if welcome_message is None:
             return
 
-        welcome_message = (await self.bot.redis.get(f'{member.guild.id}:welcome_message')).decode()
-
         transformations = {
             '%{mention}': member.mention,
             '%{user}': str(member),
@@ -7,13 +7,18 @@ import discord
 from discord.ext import commands
 
 from dog import Cog, DogBot
-from dog.core import utils
-from dog.core.utils import describe, filesize
+from dog.core import metrics, utils
+from dog.core.utils import ExpiringDict, ExpiringSet, describe, filesize
 from dog.core.context import DogbotContext
+from dog.core.outbox import ModlogEntry
 from dog.ext.censorship import CensorshipFilter
 
 logger = logging.getLogger(__name__)
 
+#: How long IDs are kept around for in the lists of events to ignore, in seconds. The events that they
+#: suppress arrive well within this.
+SUPPRESSION_TTL = 60
+
 
 async def is_publicly_visible(bot: DogBot, channel: discord.TextChannel) -> bool:
     """
@@ -74,17 +79,54 @@ class Modlog(Cog):
     def __init__(self, bot):
         super().__init__(bot)
 
-        #: A list of user IDs to not process due to being banned.
-        self.ban_debounces = []
+        #: User IDs to not process due to being banned.
+        self.ban_debounces = ExpiringSet(ttl=SUPPRESSION_TTL)
+
+        #: A dict of role additions to not process.
+        self.autorole_debounces = ExpiringDict(ttl=SUPPRESSION_TTL)
 
-        #: A list of message IDs to not process due to them being bulk deleted.
-        self.bulk_deletes = []
+        #: guild id -> {channel id: whether the channel is publicly visible}
+        self.visibility = {}
 
-        #: A list of message IDs to not process.
-        self.censored_messages = []
+    def collect_metrics(self):
+        suppressions = {'ban_debounces': self.ban_debounces, 'deletes': self.bot.deletions,
+                        'autorole_debounces': self.autorole_debounces}
+        return [metrics.gauge('dogbot_modlog_suppressions', 'IDs that the modlog is ignoring events for, by list.',
+                              samples=(({'list': name}, len(ids)) for name, ids in suppressions.items())),
+                metrics.gauge('dogbot_modlog_visibility_cache_channels', 'Channels with a cached visibility.',
+                              sum(len(channels) for channels in self.visibility.values()))]
 
-        #: A dict of role additions to not process.
-        self.autorole_debounces = {}
+    async def channel_is_public(self, channel: discord.TextChannel) -> bool:
+        """
+        Returns whether a text channel is publicly visible, like :func:`is_publicly_visible`. Results are cached
+        until the channel, the @everyone role, or the guild's configuration changes.
+        """
+        channels = self.visibility.setdefault(channel.guild.id, {})
+        try:
+            return channels[channel.id]
+        except KeyError:
+            visible = channels[channel.id] = await is_publicly_visible(self.bot, channel)
+            return visible
+
+    async def on_guild_channel_update(self, before: discord.abc.GuildChannel, after: discord.abc.GuildChannel):
+        self.visibility.get(after.guild.id, {}).pop(after.id, None)
+
+    async def on_guild_channel_delete(self, channel: discord.abc.GuildChannel):
+        self.visibility.get(channel.guild.id, {}).pop(channel.id, None)
+
+    async def on_guild_role_update(self, before: discord.Role, after: discord.Role):
+        if after.is_default():
+            self.visibility.pop(after.guild.id, None)
+
+    async def on_guild_remove(self, guild: discord.Guild):
+        self.visibility.pop(guild.id, None)
+
+    async def on_broadcast_config(self, data):
+        # log_all_message_events might have been toggled
+        self.visibility.pop(data['guild_id'], None)
+
+    async def on_broadcasts_resubscribed(self):
+        self.visibility.clear()
 
     def modlog_msg(self, msg: str) -> str:
         """
@@ -96,16 +138,18 @@ class Modlog(Cog):
         """
         return '`[{0.hour:02d}:{0.minute:02d}]` {1}'.format(datetime.datetime.utcnow(), msg)
 
-    async def log(self, guild: discord.Guild, text: str, *, do_not_format: bool=False) -> discord.Message:
+    async def log(self, guild: discord.Guild, text: str, *, do_not_format: bool=False,
+                  priority: bool=False) -> 'Optional[ModlogEntry]':
         """
-        Directly logs a message to a guild's modlog channel.
+        Logs a message to a guild's modlog channel. Entries are coalesced, so this returns before it's sent.
 
         :param guild: The guild to log to.
         :param text: The text to log.
         :param do_not_format: Disables automatic time formatting.
-        :return: The sent message.
+        :param priority: Whether this is about an action that a moderator took. These are posted first.
+        :return: The queued entry, which can be edited like a message.
         """
-        return await self.bot.send_modlog(guild, text if do_not_format else self.modlog_msg(text))
+        return await self.bot.send_modlog(guild, text if do_not_format else self.modlog_msg(text), priority=priority)
 
     async def on_guild_emojis_update(self, guild: discord.Guild, before: 'List[discord.Emoji]',
                                      after: 'List[discord.Emoji]'):
@@ -124,7 +168,7 @@ class Modlog(Cog):
         cmd = utils.prevent_codeblock_breakout(ctx.message.content)
         await self.log(ctx.guild,
                        (f'\N{WRENCH} Command invoked by {describe(ctx.author)} in '
-                        f'{describe(ctx.message.channel, mention=True)}:\n```{cmd}```'))
+                        f'{describe(ctx.message.channel, mention=True)}:\n```{cmd}```'), priority=True)
 
     async def on_voice_state_update(self, member: discord.Member, before: discord.VoiceState,
                                     after: discord.VoiceState):
@@ -146,9 +190,6 @@ class Modlog(Cog):
                        f'{describe(after.channel)}')
 
     async def on_message_censor(self, filter: CensorshipFilter, msg: discord.Message):
-        # we don't want to log message deletes for this message
-        self.censored_messages.append(msg.id)
-
         content = f': {msg.content}' if getattr(filter, 'show_content', True) else ''
         fmt = (f'\u002a\u20e3 Message by {describe(msg.author)} in {describe(msg.channel, mention=True)} censored: '
                f'{filter.mod_log_description}{content}')
@@ -174,7 +215,7 @@ class Modlog(Cog):
             return
 
         # if this channel isn't publicly visible or we aren't tracking edits, bail
-        if (not await is_publicly_visible(self.bot, before.channel) or
+        if (not await self.channel_is_public(before.channel) or
                 await self.bot.config_is_set(before.guild, 'modlog_notrack_edits')):
             return
 
@@ -213,15 +254,15 @@ class Modlog(Cog):
             fmt_before = f'\N{KEY} Roles for {describe(before)} were updated'
             fmt_diffs = describe_differences(self.bot, added_roles, removed_roles)
 
-            msg = await self.log(before.guild, f'{fmt_before}: {fmt_diffs}')
+            msg = await self.log(before.guild, f'{fmt_before}: {fmt_diffs}', priority=True)
 
             def formatter(entry):
                 return f'{fmt_before} by {describe(entry.user)}: {fmt_diffs}'
             await self.autoformat_responsible(msg, before, 'member_role_update', formatter)
 
     async def on_raw_bulk_message_delete(self, message_ids: 'List[int]', channel_id: int):
-        # add to list of bulk deletes so we don't process message delete events for these messages
-        self.bulk_deletes += message_ids
+        # don't process message delete events for these messages. this is dispatched before those are
+        self.bot.deletions.suppress(message_ids)
 
         # resolve the channel that the message was deleted in
         channel = self.bot.get_channel(channel_id)
@@ -231,24 +272,22 @@ class Modlog(Cog):
             return
 
         # log
-        await self.log(channel.guild, f'\U0001f6ae {len(message_ids)} message(s) deleted in {channel.mention}')
+        await self.log(channel.guild, f'\U0001f6ae {len(message_ids)} message(s) deleted in {channel.mention}',
+                       priority=True)
 
     async def on_message_delete(self, msg: discord.Message):
         # don't handle message deletion elsewhere
         if not isinstance(msg.channel, discord.TextChannel):
             return
 
-        # race conditions, yay!
-        # we do this because this message could possibly maybe be censored or bulk deleted
-        await asyncio.sleep(0.5)
-
-        # do not process bulk message deletes, or message censors (the censor cog does that already)
+        # do not process bulk message deletes, or message censors (the censor cog does that already). this only
+        # waits if the bot is in the middle of deleting this message
         # TODO: do this but cleanly, maybe paste website?
-        if msg.id in self.bulk_deletes or msg.id in self.censored_messages:
+        if await self.bot.deletions.is_suppressed(msg.id):
             return
 
         # if this channel isn't publicly visible or deletes shouldn't be tracked, bail
-        if (not await is_publicly_visible(self.bot, msg.channel) or
+        if (not await self.channel_is_public(msg.channel) or
                 await self.bot.config_is_set(msg.guild, 'modlog_notrack_deletes')):
             return
 
@@ -267,12 +306,12 @@ class Modlog(Cog):
 
     async def on_guild_role_create(self, role: discord.Role):
         base = f'\N{KEY} {self.bot.tick("green", guild=role.guild)} Role created: {describe(role)}'
-        msg = await self.log(role.guild, base)
+        msg = await self.log(role.guild, base, priority=True)
         await self.autoformat_responsible_nontarget(msg, action='role_create', base=base)
 
     async def on_guild_role_delete(self, role: discord.Role):
         base = f'\N{KEY} {self.bot.tick("red", guild=role.guild)} Role deleted: {describe(role)}'
-        msg = await self.log(role.guild, base)
+        msg = await self.log(role.guild, base, priority=True)
         await self.autoformat_responsible_nontarget(msg, action='role_delete', base=base)
 
     async def on_member_join(self, member: discord.Member):
@@ -333,11 +372,11 @@ class Modlog(Cog):
         """
         return f'with reason `{entry.reason}`' if entry.reason else 'with no attached reason'
 
-    async def autoformat_responsible_nontarget(self, log_message: discord.Message, *, action: str, base: str):
+    async def autoformat_responsible_nontarget(self, log_message: 'ModlogEntry', *, action: str, base: str):
         """
         Automatically edits a message sent in the audit log to include responsible information.
 
-        :param log_message: The :class:`discord.Message` that was sent in the log channel.
+        :param log_message: The :class:`dog.core.outbox.ModlogEntry` that was logged.
         :param action: The name of the :class:`discord.AuditLogAction` attr to check for.
         :param base: The text to prepend.
         """
@@ -347,7 +386,7 @@ class Modlog(Cog):
             await log_message.edit(content=self.modlog_msg(f'{base} by {describe(action.user)}'))
 
     async def autoformat_responsible(self,
-                                     log_message: discord.Message,
+                                     log_message: 'ModlogEntry',
                                      targeted: discord.Member,
                                      action: str,
                                      format_to: '(entry: discord.AuditLogEntry) -> str' = None, *,
@@ -358,7 +397,7 @@ class Modlog(Cog):
         Automatically edits a message sent in the audit log to include responsible information for a moderator action
         that includes a "targeted" user.
 
-        :param log_message: The `discord.Message` that was sent in the log channel.
+        :param log_message: The `dog.core.outbox.ModlogEntry` that was logged.
         :param targeted: The `discord.Member` that was targeted.
         :param action: The name of the `discord.AuditLogAction` attr to check for.
         :param format_to: A callable that will return the log message's new content. It will automatically be formatted
@@ -389,17 +428,17 @@ class Modlog(Cog):
 
     async def on_member_ban(self, guild: discord.Guild, user: discord.Guild):
         # don't make on_member_remove process this user's departure
-        self.ban_debounces.append(user.id)
+        self.ban_debounces.add(user.id)
 
         verb = 'was banned'
 
-        msg = await self.log(guild, self.format_member_departure(user, verb=verb, emoji='\N{HAMMER}'))
+        msg = await self.log(guild, self.format_member_departure(user, verb=verb, emoji='\N{HAMMER}'), priority=True)
         await self.autoformat_responsible(msg, user, 'ban', departure=True, departure_extra=verb,
                                           departure_emoji='\N{HAMMER}')
 
     async def on_member_unban(self, guild: discord.Guild, user: discord.User):
         base_msg = f'\N{HAMMER} {describe(user)} was unbanned'
-        msg = await self.log(guild, base_msg + '.')
+        msg = await self.log(guild, base_msg + '.', priority=True)
 
         def formatter(entry: discord.AuditLogEntry) -> str:
             return f'{base_msg} by {describe(entry.user)} {self.format_reason(entry)}.'
@@ -409,7 +448,7 @@ class Modlog(Cog):
         # this is called also when someone gets banned, but we don't want duplicate messages, so bail if this person
         # got banned as we already send a message
         if member.id in self.ban_debounces:
-            self.ban_debounces.remove(member.id)
+            self.ban_debounces.discard(member.id)
             return
 
         msg = await self.log(member.guild, self.format_member_departure(member))
@@ -430,7 +469,7 @@ class Modlog(Cog):
         """
         channel = channel if channel else ctx.channel
         public = f'{channel.mention} {{}} public to @\u200beveryone.'
-        await ctx.send(public.format('is' if await is_publicly_visible(self.bot, channel) else '**is not**'))
+        await ctx.send(public.format('is' if await self.channel_is_public(channel) else '**is not**'))
 
 
 def setup(bot):
@@ -2,19 +2,66 @@
 Statistics extension.
 """
 
+import asyncio
+import bisect
 import datetime
 import logging
-from typing import List, Union
+import re
+import time
+from typing import Dict, List, Optional, Tuple, Union
 
 import asyncpg
 import discord
 from discord.ext import commands
 
 from dog import Cog
-from dog.core import utils
+from dog.core import metrics, utils
+from dog.core.aggregates import Aggregates
+from dog.core.utils import BatchWriter
 
 logger = logging.getLogger(__name__)
 
+#: The upper bounds of the latency histogram buckets, in seconds. Slower commands go into one last bucket.
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+#: Matches a --window for d?cstats, like 24h or 7d.
+WINDOW_REGEX = re.compile(r'(\d+)([hd])')
+
+#: The longest --window that d?cstats accepts, in hours.
+MAX_WINDOW = 24 * 90
+
+#: How often the d?stats counters are counted from scratch, to correct any drift. In seconds.
+AGGREGATES_RECONCILE_INTERVAL = 60 * 30
+
+
+def current_hour() -> datetime.datetime:
+    """ Returns the start of the current hour, which rollups are bucketed by. """
+    return datetime.datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+
+
+def percentile(buckets: List[int], quantile: float) -> str:
+    """ Estimates a latency percentile from histogram buckets, and formats it. """
+    target = quantile * sum(buckets)
+    seen = 0
+    for index, count in enumerate(buckets):
+        seen += count
+        if count and seen >= target:
+            if index == len(LATENCY_BUCKETS):
+                return f'>{LATENCY_BUCKETS[-1] * 1000:,.0f}ms'
+            return f'≤{LATENCY_BUCKETS[index] * 1000:,.0f}ms'
+    return 'n/a'
+
+
+def parse_window(text: str) -> int:
+    """ Parses a --window, like 24h or 7d, into hours. """
+    match = WINDOW_REGEX.fullmatch(text)
+    if not match:
+        raise commands.BadArgument('Invalid window. Try something like `24h` or `7d`.')
+    hours = int(match.group(1)) * (24 if match.group(2) == 'd' else 1)
+    if not 0 < hours <= MAX_WINDOW:
+        raise commands.BadArgument(f'The window must be between 1 hour and {MAX_WINDOW // 24} days.')
+    return hours
+
 
 async def get_statistics(pg: asyncpg.connection.Connection, command_name: str) -> \
         Union[List[asyncpg.Record], None]:
@@ -27,72 +74,267 @@ async def get_statistics(pg: asyncpg.connection.Connection, command_name: str) -
                              command_name)
 
 
-async def last_used(pg: asyncpg.connection.Connection) -> datetime.datetime:
+async def last_used(pg: asyncpg.connection.Connection) -> Optional[datetime.datetime]:
     """
     Returns a `datetime.datetime` of the latest usage.
     """
     row = await pg.fetchrow('SELECT * FROM command_statistics WHERE command_name != '
                             '\'command_stats\' ORDER BY last_used DESC')
-    return row['last_used']
+    return row and row['last_used']
 
 
-async def update_statistics(pg: asyncpg.connection.Connection, ctx: commands.Context):
-    """
-    Updates command statistics for a specific `discord.ext.commands.Context`.
+def latency_buckets(latency: float) -> List[int]:
+    """ Returns histogram buckets that hold a single latency. """
+    buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+    buckets[bisect.bisect_left(LATENCY_BUCKETS, latency)] = 1
+    return buckets
+
+
+def empty_rollup() -> list:
+    return [0, 0, 0.0, [0] * (len(LATENCY_BUCKETS) + 1)]
 
-    If no record was found for a command, it is created. Otherwise, the ``times_used`` and
-    ``last_used`` fields are updated.
+
+def merge_rollup(rollup: list, uses: int, errors: int, latency_sum: float, buckets: List[int]):
+    """ Adds to a rollup, in place. """
+    rollup[0] += uses
+    rollup[1] += errors
+    rollup[2] += latency_sum
+    rollup[3] = [a + b for a, b in zip(rollup[3], buckets)]
+
+
+class CommandStatsWriter(BatchWriter):
+    """
+    Counts command usage in memory, and periodically adds the counts to ``command_statistics`` with one
+    upsert. Hourly rollups of usage, errors and latency are written to ``command_rollups`` the same way.
     """
-    row = await get_statistics(pg, str(ctx.command))
+    def __init__(self, bot):
+        super().__init__(bot, 'Command statistics', interval=10.0)
 
-    if row is None:
-        # first time command is being used, insert it into the database
-        insert = 'INSERT INTO command_statistics VALUES ($1, 1, $2)'
-        await pg.execute(insert, str(ctx.command), datetime.datetime.utcnow())
-        logger.info('First command usage for %s', ctx.command)
-    else:
-        # command was used before, increment time_used and update last_used
-        update = ('UPDATE command_statistics SET times_used = times_used + 1, last_used = $2 '
-                  'WHERE command_name = $1')
-        await pg.execute(update, str(ctx.command), datetime.datetime.utcnow())
+        # command name -> [times used, last used]
+        self.deltas = {}
+
+        # (command name, hour) -> [uses, errors, latency sum, latency buckets]
+        self.rollups = {}
+
+    def __len__(self):
+        return len(self.deltas) + len(self.rollups)
+
+    def pending(self) -> Dict[str, Tuple[int, datetime.datetime]]:
+        """
+        Returns the unwritten usage of every command, as ``(times used, last used)``. Hold :meth:`hold` while
+        reading this along with ``command_statistics``.
+        """
+        return {name: tuple(delta) for name, delta in self.deltas.items()}
+
+    @property
+    def pending_uses(self) -> int:
+        """ Returns the amount of command uses that haven't been written yet. """
+        return sum(times_used for times_used, _ in self.pending().values())
+
+    def pending_rollups(self, since: datetime.datetime) -> Dict[str, list]:
+        """
+        Returns the unwritten rollups of every command from an hour onwards, as
+        ``[uses, errors, latency sum, latency buckets]``.
+        """
+        pending = {}
+        for (name, hour), (uses, errors, latency_sum, buckets) in self.rollups.items():
+            if hour >= since:
+                merge_rollup(pending.setdefault(name, empty_rollup()), uses, errors, latency_sum, buckets)
+        return pending
+
+    def take(self):
+        batch = (self.deltas, self.rollups)
+        self.deltas, self.rollups = {}, {}
+        return batch
+
+    async def record(self, command_name: str, *, latency: float = None, failed: bool = False):
+        """ Records a usage of a command. Only successful uses count towards ``command_statistics``. """
+        await self.make_room()
+
+        if not failed:
+            delta = self.deltas.setdefault(command_name, [0, None])
+            delta[0] += 1
+            delta[1] = datetime.datetime.utcnow()
+
+        if latency is not None:
+            rollup = self.rollups.setdefault((command_name, current_hour()), empty_rollup())
+            merge_rollup(rollup, 1, int(failed), latency, latency_buckets(latency))
+
+        self.buffered()
+
+    def merge(self, command_name: str, record) -> Optional[Tuple[int, datetime.datetime]]:
+        """
+        Merges the unwritten usage of a command into a ``command_statistics`` row, which can be ``None``.
+        Returns ``(times used, last used)``, or ``None`` if the command was never used.
+        """
+        times_used, last_used = self.pending().get(command_name, (0, None))
+        if record is None:
+            return (times_used, last_used) if times_used else None
+        return record['times_used'] + times_used, last_used or record['last_used']
+
+    async def write(self, batch):
+        deltas, rollups = batch
+        async with self.bot.pgpool.acquire() as conn, conn.transaction():
+            if deltas:
+                await self.write_deltas(conn, deltas)
+            if rollups:
+                await self.write_rollups(conn, rollups)
+
+    async def write_rollups(self, conn, rollups):
+        upsert_sql = """
+            INSERT INTO command_rollups (command_name, hour, uses, errors, latency_sum, latency_buckets)
+            VALUES ($1, $2, $3, $4, $5, $6)
+            ON CONFLICT (command_name, hour) DO UPDATE
+            SET uses = command_rollups.uses + excluded.uses,
+                errors = command_rollups.errors + excluded.errors,
+                latency_sum = command_rollups.latency_sum + excluded.latency_sum,
+                latency_buckets = ARRAY(
+                    SELECT a + b FROM unnest(command_rollups.latency_buckets, excluded.latency_buckets) AS t(a, b)
+                )
+        """
+        await conn.executemany(upsert_sql, [(name, hour, *rollup) for (name, hour), rollup in rollups.items()])
+        self._log('debug', 'Wrote %d rollup(s).', len(rollups))
+
+    async def write_deltas(self, conn, batch):
+        upsert_sql = """
+            INSERT INTO command_statistics (command_name, times_used, last_used)
+            SELECT * FROM unnest($1::text[], $2::int[], $3::timestamp[])
+            ON CONFLICT (command_name) DO UPDATE
+            SET times_used = command_statistics.times_used + excluded.times_used,
+                last_used = greatest(command_statistics.last_used, excluded.last_used)
+        """
+        times_used, last_used = zip(*batch.values())
+        await conn.execute(upsert_sql, list(batch), times_used, last_used)
+        self._log('debug', 'Wrote %d use(s) of %d command(s).', sum(times_used), len(batch))
 
 
 class Stats(Cog):
-    async def on_command_completion(self, ctx):
-        if any('is_owner' in fun.__qualname__ for fun in ctx.command.checks):
+    def __init__(self, bot):
+        super().__init__(bot)
+        self.writer = CommandStatsWriter(bot)
+
+        #: Command name to ``[uses, errors, latency sum, latency buckets]`` since the cog was loaded, for metrics.
+        self.command_totals = {}
+
+        #: Counters for d?stats, or ``None`` if they haven't been counted yet.
+        self.aggregates = None
+        self.reconciler = bot.loop.create_task(self.reconcile_aggregates())
+
+    def __unload(self):
+        # write what's left in the background, the new writer takes over from here
+        self.bot.loop.create_task(self.writer.close())
+        self.reconciler.cancel()
+
+    async def on_command(self, ctx):
+        ctx.started_at = time.monotonic()
+
+    async def record(self, ctx, *, failed: bool):
+        if ctx.command is None or any('is_owner' in fun.__qualname__ for fun in ctx.command.checks):
             return
-        async with self.bot.pgpool.acquire() as conn:
-            await update_statistics(conn, ctx)
+        started_at = getattr(ctx, 'started_at', None)
+        latency = None if started_at is None else time.monotonic() - started_at
+        await self.writer.record(str(ctx.command), latency=latency, failed=failed)
+
+        if latency is not None:
+            rollup = self.command_totals.setdefault(str(ctx.command), empty_rollup())
+            merge_rollup(rollup, 1, int(failed), latency, latency_buckets(latency))
+
+    async def on_command_completion(self, ctx):
+        await self.record(ctx, failed=False)
+
+    async def on_command_error(self, ctx, error):
+        await self.record(ctx, failed=True)
+
+    async def reconcile_aggregates(self):
+        await self.bot.wait_until_ready()
+
+        while True:
+            aggregates = await Aggregates.build(self.bot.guilds)
+            if self.aggregates is not None:
+                logger.debug('Reconciled aggregates, %d member(s) of drift.', self.aggregates.drift(aggregates))
+            self.aggregates = aggregates
+            await asyncio.sleep(AGGREGATES_RECONCILE_INTERVAL)
+
+    def collect_metrics(self):
+        totals = self.command_totals.items()
+        families = [
+            metrics.counter('dogbot_commands_total', 'Commands invoked, by command.',
+                            samples=(({'command': name}, rollup[0]) for name, rollup in totals)),
+            metrics.counter('dogbot_command_errors_total', 'Commands that failed, by command.',
+                            samples=(({'command': name}, rollup[1]) for name, rollup in totals)),
+            metrics.histogram('dogbot_command_duration_seconds', 'How long commands took, by command.',
+                              LATENCY_BUCKETS, (({'command': name}, rollup[3], rollup[2]) for name, rollup in totals)),
+        ]
+
+        agg = self.aggregates
+        if agg:
+            families += [
+                metrics.gauge('dogbot_members', 'Guild members, by status. Members are counted once per guild.',
+                              samples=(({'status': str(status)}, count) for status, count in agg.statuses.items())),
+                metrics.gauge('dogbot_bots', 'Unique bot users.', agg.bots),
+            ]
+
+        return families
+
+    async def on_member_join(self, member):
+        if self.aggregates:
+            self.aggregates.add_member(member)
+
+    async def on_member_remove(self, member):
+        if self.aggregates:
+            self.aggregates.add_member(member, -1)
+
+    async def on_member_update(self, before, after):
+        if self.aggregates:
+            self.aggregates.update_member(before, after)
+
+    async def on_guild_join(self, guild):
+        if self.aggregates:
+            self.aggregates.add_guild(guild)
+
+    async def on_guild_remove(self, guild):
+        if self.aggregates:
+            self.aggregates.add_guild(guild, -1)
+
+    async def on_guild_channel_create(self, channel):
+        if self.aggregates:
+            self.aggregates.add_channel(channel)
+
+    async def on_guild_channel_delete(self, channel):
+        if self.aggregates:
+            self.aggregates.add_channel(channel, -1)
+
+    async def on_guild_emojis_update(self, guild, before, after):
+        if self.aggregates:
+            self.aggregates.add_emojis(before, -1)
+            self.aggregates.add_emojis(after)
 
     @commands.command()
     async def stats(self, ctx):
         """ Shows participation info about the bot. """
-        # TODO: Make this function neater. It's currently trash.
+        agg = self.aggregates
+        if agg is None:
+            return await ctx.send("I'm still counting everything, try again in a bit.")
 
         # member stats
-        all_members = list(self.bot.get_all_members())
-
-        def filter_members_by_status(status):
-            return len([m for m in all_members if m.status == status])
-        num_members = len(all_members)
-        num_online = filter_members_by_status(discord.Status.online)
-        num_idle = filter_members_by_status(discord.Status.idle)
-        num_dnd = filter_members_by_status(discord.Status.dnd)
-        num_offline = filter_members_by_status(discord.Status.offline)
-        perc_online = f'{round(num_online / num_members * 100, 2)}% is online'
+        num_members = agg.members
+        num_online = agg.statuses[discord.Status.online]
+        num_idle = agg.statuses[discord.Status.idle]
+        num_dnd = agg.statuses[discord.Status.dnd]
+        num_offline = agg.statuses[discord.Status.offline]
+        perc_online = f'{round(num_online / max(num_members, 1) * 100, 2)}% is online'
 
         # channel stats
-        all_channels = list(self.bot.get_all_channels())
-        num_channels = len(all_channels)
-        num_voice_channels = len([c for c in all_channels if isinstance(c, discord.VoiceChannel)])
-        num_text_channels = len([c for c in all_channels if isinstance(c, discord.TextChannel)])
+        num_channels = sum(agg.channels.values())
+        num_voice_channels = agg.channels['voice']
+        num_text_channels = agg.channels['text']
 
         # other stats
-        num_emojis = len(self.bot.emojis)
-        num_emojis_managed = len([e for e in self.bot.emojis if e.managed])
-        num_servers = len(self.bot.guilds)
-        member_counts = [len(g.members) for g in self.bot.guilds]
-        average_member_count = int(sum(member_counts) / len(member_counts))
+        num_emojis = agg.emojis
+        num_emojis_managed = agg.managed_emojis
+        num_servers = len(agg.guild_members)
+        member_counts = agg.guild_members.values() or [0]
+        average_member_count = int(num_members / max(num_servers, 1))
         uptime = str(datetime.datetime.utcnow() - self.bot.boot_time)[:-7]
 
         def cm(v):
@@ -115,35 +357,93 @@ class Stats(Cog):
             embed.add_field(name=name, value=value)
         await ctx.send(embed=embed)
 
+    async def show_rollups(self, ctx, hours: int, *, slowest: bool):
+        since = current_hour() - datetime.timedelta(hours=hours - 1)
+        select = 'SELECT command_name, uses, errors, latency_sum, latency_buckets FROM command_rollups WHERE hour >= $1'
+
+        async with self.writer.hold(), self.bot.pgpool.acquire() as conn:
+            totals = self.writer.pending_rollups(since)
+            for record in await conn.fetch(select, since):
+                merge_rollup(totals.setdefault(record['command_name'], empty_rollup()), record['uses'],
+                             record['errors'], record['latency_sum'], record['latency_buckets'])
+
+        if not totals:
+            return await ctx.send('No commands were used in that window.')
+
+        if slowest:
+            # order by average latency, p95 alone is too coarse to rank by
+            top = sorted(totals.items(), key=lambda item: item[1][2] / item[1][0], reverse=True)[:5]
+            title = f'Slowest commands in the last {hours} hour(s)'
+        else:
+            top = sorted(totals.items(), key=lambda item: item[1][0], reverse=True)[:5]
+            title = f'Most used commands in the last {hours} hour(s)'
+
+        uses = sum(rollup[0] for rollup in totals.values())
+        embed = discord.Embed(title=title)
+        embed.set_footer(text=f'{utils.commas(uses)} use(s) total, {uses / hours:,.1f} per hour')
+
+        for name, (uses, errors, latency_sum, buckets) in top:
+            value = (f'Used {utils.commas(uses)} time(s), {utils.commas(errors)} error(s)\n'
+                     f'{latency_sum / uses * 1000:,.0f}ms average, {percentile(buckets, 0.5)} p50, '
+                     f'{percentile(buckets, 0.95)} p95')
+            embed.add_field(name=name, value=value, inline=False)
+
+        await ctx.send(embed=embed)
+
     @commands.command(aliases=['cstats'])
     async def command_stats(self, ctx, *, command: str=None):
-        """ Shows commands statistics. """
+        """
+        Shows commands statistics.
+
+        --window <24h, 7d, ...> shows the most used commands in a window of time, instead of all time.
+        --slowest shows the slowest commands instead (in the last 24 hours, unless a window is given).
+        """
+
+        if command and command.startswith('--'):
+            # accept both --window 24h and --window=24h
+            flags = command.replace('=', ' ').split()
+            hours = 24
+            if '--window' in flags:
+                index = flags.index('--window')
+                hours = parse_window(flags[index + 1] if index + 1 < len(flags) else '')
+            return await self.show_rollups(ctx, hours, slowest='--slowest' in flags)
 
         if command:
-            async with self.bot.pgpool.acquire() as conn:
-                record = await get_statistics(conn, command)
-            if not record:
+            async with self.writer.hold(), self.bot.pgpool.acquire() as conn:
+                stats = self.writer.merge(command, await get_statistics(conn, command))
+            if not stats:
                 return await ctx.send('There are no statistics for that command.')
             embed = discord.Embed(title=f'Statistics for `{command}`')
-            embed.add_field(name='Times used', value=utils.commas(record['times_used']))
-            embed.add_field(name='Last used', value=utils.ago(record['last_used']))
+            embed.add_field(name='Times used', value=utils.commas(stats[0]))
+            embed.add_field(name='Last used', value=utils.ago(stats[1]))
             return await ctx.send(embed=embed)
 
+        # the top 5 commands are either in the top 5 that have been written, or have unwritten uses
         select = 'SELECT * FROM command_statistics ORDER BY times_used DESC LIMIT 5'
-        async with self.bot.pgpool.acquire() as conn:
-            records = await conn.fetch(select)
+        select_pending = 'SELECT * FROM command_statistics WHERE command_name = ANY($1::text[])'
+        async with self.writer.hold(), self.bot.pgpool.acquire() as conn:
+            records = {r['command_name']: r for r in await conn.fetch(select)}
+            pending = self.writer.pending()
+            records.update({r['command_name']: r for r in await conn.fetch(select_pending, list(pending))})
+            lu = await last_used(conn)
+
+        stats = {name: self.writer.merge(name, records.get(name)) for name in set(records) | set(pending)}
+        top = sorted(stats.items(), key=lambda item: item[1][0], reverse=True)[:5]
+
+        # unwritten uses are always more recent
+        pending_last_used = [used for name, (_, used) in pending.items() if name != 'command_stats']
+        lu = max(pending_last_used, default=lu)
 
         medals = [':first_place:', ':second_place:', ':third_place:']
         embed = discord.Embed(title='Most used commands')
-        async with self.bot.pgpool.acquire() as conn:
-            lu = utils.ago(await last_used(conn))
-        embed.set_footer(text=f'Last command usage was {lu}')
+        if lu:
+            embed.set_footer(text=f'Last command usage was {utils.ago(lu)}')
 
-        for index, record in enumerate(records):
+        for index, (name, (times_used, last_used_at)) in enumerate(top):
             medal = medals[index] if index < 3 else ''
-            td = utils.ago(record['last_used'])
-            used = 'Used {} time(s) (last used {})'.format(utils.commas(record['times_used']), td)
-            embed.add_field(name=medal + record['command_name'], value=used, inline=False)
+            td = utils.ago(last_used_at)
+            used = 'Used {} time(s) (last used {})'.format(utils.commas(times_used), td)
+            embed.add_field(name=medal + name, value=used, inline=False)
 
         await ctx.send(embed=embed)
 